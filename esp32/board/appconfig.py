@@ -17,12 +17,23 @@ class AppConfig:
     
     
     IMAGE_RELOAD_PERIOD_MS = 15*60*1000
+    
+    # bounds for the sleep time the server suggests (X-Next-Update-Sec),
+    # IMAGE_RELOAD_PERIOD_MS is used when it suggests none
+    SLEEP_MIN_MS = 5*60*1000
+    SLEEP_MAX_MS = 60*60*1000
 
 
     SCR_WIDTH = 128
     SCR_HEIGHT = 296
     SCR_BYTES_PER_LINE = int(SCR_WIDTH/8)
     
+    # partial updates redraw only the changed lines without flashing,
+    # every FULL_REFRESH_EVERY-th update is a full one to clear ghosting
+    FULL_REFRESH_EVERY = 8
+    PARTIAL_MAX_LINES = SCR_HEIGHT//2
+    FRAME_FILE = "frame.bin"
+    
 
     AP_SSID = '<your wifi ssid>'
     AP_PASS = '<your wifi password>'
@@ -30,6 +41,15 @@ class AppConfig:
     
     URL = "<url that points to the bmp image>"
     
+    # url of the server's test.delta, used instead of URL when set:
+    # only the lines changed since the last frame are downloaded
+    URL_DELTA = None
+    
+    # read the bmp from URL straight into the display, STREAM_LINES lines
+    # at a time, instead of loading the whole image first
+    STREAM_LOAD = False
+    STREAM_LINES = 8
+    
     ERROR_RETRY_SEC = 30*60
     
     
@@ -44,9 +64,11 @@ class AppConfig:
         print("Pin RST =", self.PIN_RST)
         print("Pin BUSY =", self.PIN_BUSY)
         print("Pin LED =", self.PIN_LED)
+        print("Full refresh every", self.FULL_REFRESH_EVERY)
         print("SSID", self.AP_SSID)
         print("PASS", self.AP_PASS)
         print("URL", self.URL)
+        print("URL delta", self.URL_DELTA)
         
         
         
@@ -9,7 +9,12 @@ except ImportError:
 
 class BitmapFont:
 
-    def __init__(self, width, height, setpixelproc, font_name='font5x8.bin'):
+    # Glyphs of this character range are read into memory by init(),
+    # others are read from the font file when drawn.
+    FIRST_CHAR = 32
+    LAST_CHAR = 126
+
+    def __init__(self, width, height, setpixelproc, font_name='font5x8.bin', setcolumnproc=None):
         # Specify the drawing area width and height, and the pixel function to
         # call when drawing pixels (should take an x and y param at least).
         # Optionally specify font_name to override the font file to use (default
@@ -22,10 +27,13 @@ class BitmapFont:
         #            data (i.e. a 5x8 font has 5 bytes per character).
         
         #  setpixelproc(x,y) - draw pixel at x,y
+        #  setcolumnproc(x,y,bits) - optional, draw a whole glyph column at
+        #                            x,y: bit n of bits is the pixel x,y+n
         
         self._width = width
         self._height = height
         self._setpixelproc = setpixelproc
+        self._setcolumnproc = setcolumnproc
         self._font_name = font_name
 
     def init(self):
@@ -33,6 +41,10 @@ class BitmapFont:
         # Note that only fonts up to 8 pixels tall are currently supported.
         self._font = open(self._font_name, 'rb')
         self._font_width, self._font_height = ustruct.unpack('BB', self._font.read(2))
+        # Column bytes of the FIRST_CHAR..LAST_CHAR glyphs, one read.
+        self._font.seek(2 + self.FIRST_CHAR * self._font_width)
+        self._glyphs = self._font.read((self.LAST_CHAR - self.FIRST_CHAR + 1) * self._font_width)
+        self._column_mask = (1 << self._font_height) - 1
 
     def deinit(self):
         # Close the font file as cleanup.
@@ -57,11 +69,23 @@ class BitmapFont:
         if x < -self._font_width or x >= self._width or \
            y < -self._font_height or y >= self._height:
             return
+        code = ord(ch)
+        if self.FIRST_CHAR <= code <= self.LAST_CHAR:
+            glyph = self._glyphs
+            start = (code - self.FIRST_CHAR) * self._font_width
+        else:
+            self._font.seek(2 + code * self._font_width)
+            glyph = self._font.read(self._font_width)
+            start = 0
         # Go through each column of the character.
         for char_x in range(self._font_width):
             # Grab the byte for the current column of font data.
-            self._font.seek(2 + (ord(ch) * self._font_width) + char_x)
-            line = ustruct.unpack('B', self._font.read(1))[0]
+            line = glyph[start + char_x]
+            if self._setcolumnproc is not None:
+                line &= self._column_mask
+                if line:
+                    self._setcolumnproc(x + char_x, y, line)
+                continue
             # Go through each row in the column byte.
             for char_y in range(self._font_height):
                 # Draw a pixel for each bit that's flipped on.
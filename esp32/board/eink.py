@@ -2,11 +2,21 @@ from machine import Pin, SPI
 import time
 from epaper2in9 import EPD
 from screenbuffer import Screen
-from imagecomparer import ImageComparer
+from framestore import FrameStore
 
 
 
 
+def readinto_exactly(stream,buf):
+    got = 0
+    while got<len(buf):
+        n = stream.readinto(buf[got:])
+        if not n:
+            return False
+        got+=n
+    return True
+
+
 class EInk:
     
     
@@ -27,13 +37,21 @@ class EInk:
         rst = Pin(appcfg.PIN_RST,Pin.OUT)
         busy = Pin(appcfg.PIN_BUSY,Pin.IN)
         self.dev = EPD(spi, cs, dc, rst, busy)
-        self.dev.init()
+        # the panel is reset on its first use only, a wake that finds
+        # the frame unchanged does not touch it
+        self.ready = False
         print("EInk init")
         
         self.scr = Screen(appcfg)
-        self.cmp = ImageComparer()
+        self.store = FrameStore(appcfg)
 
         
+    def init_panel(self):
+        if not self.ready:
+            self.dev.init()
+            self.ready = True
+        
+        
     def clear(self):
         self.scr.clear()        
         
@@ -41,12 +59,92 @@ class EInk:
         self.show(self.scr.data)
         
         
-    def show(self,data):
-        isthesame = self.cmp.check(data)
-        if (isthesame):
-            print("EInk upadate skipped")
-        self.dev.set_frame_memory(data, 0, 0, self.cfg.SCR_WIDTH, self.cfg.SCR_HEIGHT)
+    # version: server ETag of the frame, base for the next delta download
+    def show(self,data,version=None):
+        if self.store.frame is None:
+            lines = (0,self.cfg.SCR_HEIGHT-1)
+        else:
+            lines = self.store.dirty_lines(data)
+        return self.refresh(data,lines,version)
+        
+        
+    # Streams the pixel data of a frame from stream straight into the panel
+    # memory, STREAM_LINES lines at a time. The only full frame in RAM is
+    # the previous one kept by the store, which is updated in place.
+    # Returns None if the stream ended early; the store is then forgotten,
+    # as neither it nor the panel holds a whole frame.
+    def show_stream(self,stream,version=None):
+        bpl = self.cfg.SCR_BYTES_PER_LINE
+        height = self.cfg.SCR_HEIGHT
+        frame = self.store.frame
+        if frame is None:
+            frame = bytearray(b'\xff') * (bpl*height)
+        buf = bytearray(self.cfg.STREAM_LINES*bpl)
+        first = None
+        last = None
+        
+        self.init_panel()
+        self.dev.begin_frame_memory(0, 0, self.cfg.SCR_WIDTH, height)
+        for line in range(0,height,self.cfg.STREAM_LINES):
+            n = min(self.cfg.STREAM_LINES,height-line)*bpl
+            chunk = memoryview(buf)[:n]
+            if not readinto_exactly(stream,chunk):
+                print("EInk stream ended at line",line)
+                self.store.invalidate()
+                return None
+            self.dev.write_frame_memory(chunk)
+            for i in range(0,n,bpl):
+                pos = line*bpl+i
+                if frame[pos:pos+bpl]!=buf[i:i+bpl]:
+                    if first is None:
+                        first = pos//bpl
+                    last = pos//bpl
+            frame[line*bpl:line*bpl+n] = chunk
+        
+        if self.store.frame is None:
+            lines = (0,height-1)
+        elif first is None:
+            lines = None
+        else:
+            lines = (first,last)
+        return self.refresh(frame,lines,version,written=True,adopt=True)
+        
+        
+    # lines: first and last changed line, None if nothing changed.
+    # written: the whole frame is already in the panel memory.
+    # adopt: the store may keep data instead of a copy
+    def refresh(self,data,lines,version=None,written=False,adopt=False):
+        if lines is None:
+            print("EInk update skipped")
+            if version!=self.store.version:
+                self.store.save(data,self.store.partial_count,version,adopt)
+            return False
+        
+        # before set_lut: init() resets the controller to LUT_FULL_UPDATE
+        self.init_panel()
+        first,last = lines
+        count = self.store.partial_count
+        if (self.store.frame is None) or (count>=self.cfg.FULL_REFRESH_EVERY) or (last-first+1>self.cfg.PARTIAL_MAX_LINES):
+            print("EInk full update")
+            self.dev.set_lut(self.dev.LUT_FULL_UPDATE)
+            first,last = 0,self.cfg.SCR_HEIGHT-1
+            count = 0
+        else:
+            # the panel memory still holds the previous frame, only the changed lines are sent
+            print("EInk partial update, lines %i-%i" % (first,last))
+            self.dev.set_lut(self.dev.LUT_PARTIAL_UPDATE)
+            count+=1
+        
+        # the panel toggles between two memory areas on every display_frame,
+        # so the lines are written again afterwards to keep both in step
+        bpl = self.cfg.SCR_BYTES_PER_LINE
+        lines = memoryview(data)[first*bpl:(last+1)*bpl]
+        if not written:
+            self.dev.set_frame_memory(lines, 0, first, self.cfg.SCR_WIDTH, last-first+1)
         self.dev.display_frame()
+        self.dev.set_frame_memory(lines, 0, first, self.cfg.SCR_WIDTH, last-first+1)
+        self.store.save(data,count,version,adopt)
+        return True
         
         
     def print(self,text):
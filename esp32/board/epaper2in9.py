@@ -120,6 +120,12 @@ class EPD:
 
     # put an image in the frame memory
     def set_frame_memory(self, image, x, y, w, h):
+        self.begin_frame_memory(x, y, w, h)
+        self._data(image)
+
+    # start writing an image to the frame memory, the data follows in
+    # any number of write_frame_memory calls
+    def begin_frame_memory(self, x, y, w, h):
         # x point must be the multiple of 8 or the last 3 bits will be ignored
         x = x & 0xF8
         w = w & 0xF8
@@ -136,7 +142,10 @@ class EPD:
 
         self.set_memory_area(x, y, x_end, y_end)
         self.set_memory_pointer(x, y)
-        self._command(WRITE_RAM, image)
+        self._command(WRITE_RAM)
+
+    def write_frame_memory(self, data):
+        self._data(data)
 
     # replace the frame memory with the specified color
     def clear_frame_memory(self, color):
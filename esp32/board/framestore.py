@@ -0,0 +1,86 @@
+import machine
+import os
+
+
+
+# Last frame shown on the panel, kept in flash because deepsleep clears RAM.
+# File layout: 1 byte partial update count, 1 byte version length,
+# the version (server ETag of the frame), then the frame bytes.
+
+class FrameStore():
+
+
+    def __init__(self,appcfg):
+        self.filename = appcfg.FRAME_FILE
+        self.bpl = appcfg.SCR_BYTES_PER_LINE
+        self.size = appcfg.SCR_BYTES_PER_LINE*appcfg.SCR_HEIGHT
+        self.frame = None
+        self.version = None
+        self.partial_count = 0
+        # the panel keeps its memory only while the board stays powered
+        if machine.reset_cause()==machine.DEEPSLEEP_RESET:
+            self.load()
+
+
+    def load(self):
+        try:
+            with open(self.filename,'rb') as f:
+                head = f.read(2)
+                version = f.read(head[1]) if len(head)==2 else b''
+                frame = bytearray(self.size)
+                n = f.readinto(frame)
+                extra = f.read(1)
+        except OSError:
+            return
+        if (len(head)!=2) or (n!=self.size) or extra:
+            return
+        self.partial_count = head[0]
+        self.version = version.decode() if version else None
+        self.frame = frame
+
+
+    # adopt: frame is a buffer nobody else writes to, kept instead of copied
+    def save(self,frame,partial_count,version=None,adopt=False):
+        # copied in place, the frame kept is not reallocated
+        if self.frame is None:
+            self.frame = frame if adopt else bytearray(frame)
+        elif self.frame is not frame:
+            self.frame[:] = frame
+        self.version = version
+        self.partial_count = partial_count
+        ver = version.encode() if version else b''
+        try:
+            with open(self.filename,'wb') as f:
+                f.write(bytearray([min(partial_count,255),len(ver)]))
+                f.write(ver)
+                f.write(frame)
+        except OSError as e:
+            print("Frame store failed:",e)
+
+
+    # forget the frame, the panel memory no longer matches it
+    def invalidate(self):
+        self.frame = None
+        self.version = None
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+    # first and last line that differ from the stored frame,
+    # None if nothing changed
+    def dirty_lines(self,frame):
+        old = self.frame
+        new = frame
+        bpl = self.bpl
+        nlines = self.size//bpl
+        first = 0
+        while (first<nlines) and (old[first*bpl:(first+1)*bpl]==new[first*bpl:(first+1)*bpl]):
+            first+=1
+        if first==nlines:
+            return None
+        last = nlines-1
+        while old[last*bpl:(last+1)*bpl]==new[last*bpl:(last+1)*bpl]:
+            last-=1
+        return (first,last)
@@ -1,26 +1,55 @@
+import machine
+import uhashlib
+import ubinascii
 
 
 
+# ETag and hash of the frame on the panel, kept in RTC memory so they
+# survive deepsleep: an unchanged frame is neither downloaded nor redrawn.
+# RTC memory layout: "<etag>\n<sha1 hex>"
 
 class ImageComparer():
 
 
     def __init__(self):
+        self.rtc = machine.RTC()
         self.reset()
-        
+        if machine.reset_cause()==machine.DEEPSLEEP_RESET:
+            self.load()
+
 
     def reset(self):
+        self.etag = None
         self.hash = None
+        self.pending = None
+
+
+    def load(self):
+        data = self.rtc.memory()
+        if b'\n' not in data:
+            return
+        etag,hash = bytes(data).split(b'\n',1)
+        self.etag = etag.decode() if etag else None
+        self.hash = hash.decode() if hash else None
+
+
+    def save(self):
+        self.rtc.memory((self.etag or '')+'\n'+(self.hash or ''))
+
 
     def checksum(self,msg):
-        v = 21
-        for c in msg:
-            v ^= c
-        return v
+        return ubinascii.hexlify(uhashlib.sha1(msg).digest()).decode()
 
 
+    # True if msg is the frame already shown
     def check(self,msg):
-        hash = self.checksum(msg)
-        result = (self.hash == hash)
-        self.hash = hash
-        return result
\ No newline at end of file
+        self.pending = self.checksum(msg)
+        return (self.hash == self.pending)
+
+
+    # called once the frame checked last (None for a streamed one) is shown
+    def update(self,etag=None):
+        self.hash = self.pending
+        self.etag = etag
+        self.pending = None
+        self.save()
@@ -1,6 +1,7 @@
 from appconfig import AppConfig
-from wifi import WiFi
+from wifi import WiFi,NOT_MODIFIED
 from eink import EInk
+from imagecomparer import ImageComparer
 from led import Led,LedDummy
 from esp32_regs import GetResetCauseText
 
@@ -18,6 +19,9 @@ def print_message(text=None):
         eink.print("")
         eink.print(text)
     eink.update()
+    # the panel no longer shows the last frame
+    cmp.reset()
+    cmp.save()
     led.blink()
 
 def print_error(text):
@@ -33,6 +37,7 @@ cfg = AppConfig()
 led = LedDummy()
 wlan = WiFi(cfg,led)
 eink = EInk(cfg)
+cmp = ImageComparer()
 
 cfg.print()
 print("------")
@@ -54,15 +59,37 @@ while (True):
         print_error("WiFi connection failed.")
         continue
     
-    img = wlan.load()
-    if (img):
-        eink.show(img)
+    if cfg.STREAM_LOAD:
+        img = wlan.load_stream(cmp.etag)
+    elif cfg.URL_DELTA:
+        img = wlan.load_delta(eink.store)
     else:
+        img = wlan.load(cmp.etag)
+    
+    if (img==NOT_MODIFIED):
+        print("Frame not changed, back to sleep")
+    elif (not img):
         print_error("Image load failed.")
         continue
+    elif cfg.STREAM_LOAD:
+        r,stream,etag = img
+        rc = eink.show_stream(stream,etag)
+        r.close()
+        if (rc is None):
+            print_error("Image load failed.")
+            continue
+        cmp.update(etag)
+    elif cmp.check(img[0]):
+        print("Same frame, back to sleep")
+        cmp.update(img[1])
+    else:
+        eink.show(*img)
+        cmp.update(img[1])
     
 
-    deepsleep(cfg.IMAGE_RELOAD_PERIOD_MS)
+    sleep_ms = wlan.sleep_ms()
+    print("Sleeping %i s" % (sleep_ms//1000))
+    deepsleep(sleep_ms)
 
 
 
@@ -0,0 +1,66 @@
+# Decodes a PackBits stream (test.rle) on the fly: a header byte n, then
+# n+1 literal bytes for n<128, or one byte repeated 257-n times for n>128.
+# Works like a stream with readinto, so EInk.show_stream can read it.
+
+class PackBitsReader():
+
+
+    def __init__(self,stream,bufsize=64):
+        self.stream = stream
+        self.inbuf = bytearray(bufsize)
+        self.inpos = 0
+        self.inlen = 0
+        self.literal = 0
+        self.repeat = 0
+        self.value = 0
+
+
+    def fill(self):
+        if self.inpos<self.inlen:
+            return True
+        self.inlen = self.stream.readinto(self.inbuf) or 0
+        self.inpos = 0
+        return self.inlen>0
+
+
+    def readbyte(self):
+        if not self.fill():
+            return -1
+        b = self.inbuf[self.inpos]
+        self.inpos+=1
+        return b
+
+
+    # returns the number of bytes decoded into buf, 0 at the end of stream
+    def readinto(self,buf):
+        n = len(buf)
+        i = 0
+        while i<n:
+            if self.repeat:
+                k = min(self.repeat,n-i)
+                v = self.value
+                for j in range(i,i+k):
+                    buf[j] = v
+                i+=k
+                self.repeat-=k
+            elif self.literal:
+                if not self.fill():
+                    break
+                k = min(self.literal,n-i,self.inlen-self.inpos)
+                buf[i:i+k] = self.inbuf[self.inpos:self.inpos+k]
+                self.inpos+=k
+                i+=k
+                self.literal-=k
+            else:
+                h = self.readbyte()
+                if h<0:
+                    break
+                if h<128:
+                    self.literal = h+1
+                elif h>128:
+                    v = self.readbyte()
+                    if v<0:
+                        break
+                    self.value = v
+                    self.repeat = 257-h
+        return i
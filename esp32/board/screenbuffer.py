@@ -16,7 +16,7 @@ class Screen:
         self.bufsize = int(appcfg.SCR_WIDTH*appcfg.SCR_HEIGHT/8)
         self.clear()
         #self.bf = bitmapfont.BitmapFont(appcfg.SCR_WIDTH , appcfg.SCR_HEIGHT, self.set_pixel_v)
-        self.bf = bitmapfont.BitmapFont(appcfg.SCR_HEIGHT, appcfg.SCR_WIDTH , self.set_pixel_h) 
+        self.bf = bitmapfont.BitmapFont(appcfg.SCR_HEIGHT, appcfg.SCR_WIDTH , self.set_pixel_h, setcolumnproc=self.set_column_h) 
         self.bf.init()
         print(">>> *init")       
         
@@ -34,6 +34,22 @@ class Screen:
         self.scrbuf[pos] &= bit_not(mask)
         #self.scrbuf[pos] = 0
         
+    # same pixels as set_pixel_h(x,y+n) for every bit n of bits, in at most
+    # two byte writes: the column lies along one panel line
+    def set_column_h(self,x,y,bits):
+        if (x<0) or (x*self.BYTES_PER_LINE>=self.bufsize):
+            return
+        if y<0:
+            bits >>= -y
+            y = 0
+        pos = self.BYTES_PER_LINE*x + (self.BYTES_PER_LINE-1)
+        pos -= y>>3
+        shift = y & 7
+        if y>>3 < self.BYTES_PER_LINE:
+            self.scrbuf[pos] &= ~(bits << shift) & 0xFF
+        if shift and ((y>>3)+1 < self.BYTES_PER_LINE):
+            self.scrbuf[pos-1] &= ~(bits >> (8-shift)) & 0xFF
+        
         
         
         
@@ -1,10 +1,22 @@
 import network
 import urequests
+import ustruct
 import time
+from packbits import PackBitsReader
 
 def lebytes_to_int(bytes):
     return int.from_bytes(bytes, 'little')
 
+# returned by the loaders when the server has the same frame as etag
+NOT_MODIFIED = 304
+
+def get_header(r,name):
+    name = name.lower()
+    for key in r.headers:
+        if key.lower()==name:
+            return r.headers[key]
+    return None
+
 
 class WiFi:
     
@@ -14,6 +26,7 @@ class WiFi:
         self.cfg = appcfg
         self.wlan = network.WLAN(network.STA_IF)
         self.wlan.active(True)
+        self.next_update_sec = None
         print("WiFi init")
         
         
@@ -42,16 +55,64 @@ class WiFi:
         return connected
     
     
-    def load(self):
+    # GET url, conditional on the ETag of the frame shown; keeps the
+    # server's hint when the image will change next
+    def get(self,url,etag=None):
+        headers = {'accept': 'image/bmp'}
+        if etag:
+            headers['If-None-Match'] = '"%s"' % etag
+        r = urequests.get(url, headers=headers)
+        self.next_update_sec = None
+        if r is not None:
+            sec = get_header(r,'X-Next-Update-Sec')
+            if sec:
+                try:
+                    self.next_update_sec = int(sec)
+                except ValueError:
+                    pass
+        return r
+    
+    
+    # how long to sleep until the next image: the server's hint bounded
+    # by SLEEP_MIN_MS and SLEEP_MAX_MS, IMAGE_RELOAD_PERIOD_MS without it
+    def sleep_ms(self):
+        if self.next_update_sec is None:
+            return self.cfg.IMAGE_RELOAD_PERIOD_MS
+        return min(max(self.next_update_sec*1000,self.cfg.SLEEP_MIN_MS),self.cfg.SLEEP_MAX_MS)
+    
+    
+    def get_etag(self,r):
+        etag = get_header(r,'ETag')
+        return etag.strip('"') if etag else None
+    
+    
+    # returns the frame and its etag, or NOT_MODIFIED
+    def load(self,etag=None):
         print("Loading "+self.cfg.URL)
         
         self.led.blink()
-        r = urequests.get(self.cfg.URL, headers={'accept': 'image/bmp'})
+        r = self.get(self.cfg.URL,etag)
     
-        if (r==None) or (r.content==None) or (len(r.content)<54):
+        if (r==None):
+            return None
+        if r.status_code==304:
+            print("Image not changed")
+            self.led.off()
+            return NOT_MODIFIED
+        if (r.status_code!=200) or (r.content==None):
             return None
     
         img_bytes = r.content
+        
+        # raw frame (test.raw) is already in the panel memory layout
+        if len(img_bytes)==self.cfg.SCR_BYTES_PER_LINE*self.cfg.SCR_HEIGHT:
+            print("Frame loaded")
+            self.led.off()
+            return (img_bytes,self.get_etag(r))
+    
+        if len(img_bytes)<54:
+            return None
+    
         start_pos = lebytes_to_int(img_bytes[10:14])
         end_pos = start_pos + lebytes_to_int(img_bytes[34:38])
         width = lebytes_to_int(img_bytes[18:22])
@@ -64,7 +125,102 @@ class WiFi:
         
         self.led.off()
 
-        return img_bytes[start_pos:]
+        return (img_bytes[start_pos:],self.get_etag(r))
+    
+    
+    # Loads only the lines changed since the frame in store (test.delta),
+    # returns the new frame and its version, or NOT_MODIFIED
+    def load_delta(self,store):
+        url = self.cfg.URL_DELTA
+        base = store.version if (store.frame is not None) else None
+        if base:
+            url += ('&' if '?' in url else '?') + 'base=' + base
+        print("Loading "+url)
+        
+        self.led.blink()
+        r = self.get(url)
+        
+        if (r==None):
+            return None
+        if r.status_code==304:
+            print("Frame not changed")
+            self.led.off()
+            return NOT_MODIFIED
+        if (r.status_code!=200) or (r.content==None):
+            return None
+        
+        version = self.get_etag(r)
+        if (base is not None) and (get_header(r,'X-Frame-Base')==base):
+            frame = bytearray(store.frame)
+        else:
+            frame = bytearray(b'\xff') * (self.cfg.SCR_BYTES_PER_LINE*self.cfg.SCR_HEIGHT)
+        
+        # records: <HH first line, line count, then the bytes of those lines
+        delta = r.content
+        bpl = self.cfg.SCR_BYTES_PER_LINE
+        pos = 0
+        while pos+4<=len(delta):
+            first,count = ustruct.unpack_from("<HH", delta, pos)
+            pos+=4
+            if (first+count>self.cfg.SCR_HEIGHT) or (pos+count*bpl>len(delta)):
+                print("Bad frame delta")
+                return None
+            frame[first*bpl:(first+count)*bpl] = delta[pos:pos+count*bpl]
+            pos+=count*bpl
+        
+        print("Frame delta loaded, %i bytes" % len(delta))
+        self.led.off()
+        
+        return (frame,version)
+    
+    
+    # Requests the image and reads its headers only, returns the response,
+    # a stream of the frame bytes for EInk.show_stream and the etag, or
+    # NOT_MODIFIED. Reads a bmp, a raw frame (test.raw) or a PackBits
+    # coded one (test.rle), told apart by the content type.
+    def load_stream(self,etag=None):
+        print("Streaming "+self.cfg.URL)
+        
+        self.led.blink()
+        r = self.get(self.cfg.URL,etag)
+        if (r==None):
+            return None
+        if r.status_code==304:
+            print("Image not changed")
+            r.close()
+            self.led.off()
+            return NOT_MODIFIED
+        if (r.status_code!=200):
+            r.close()
+            return None
+        
+        ctype = get_header(r,'Content-Type') or ''
+        if 'packbits' in ctype:
+            self.led.off()
+            return (r,PackBitsReader(r.raw),self.get_etag(r))
+        if 'octet-stream' in ctype:
+            self.led.off()
+            return (r,r.raw,self.get_etag(r))
+        
+        header = r.raw.read(54)
+        if (len(header)!=54) or (header[0:2]!=b'BM'):
+            r.close()
+            return None
+        start_pos = lebytes_to_int(header[10:14])
+        width = lebytes_to_int(header[18:22])
+        height = lebytes_to_int(header[22:26])
+        
+        if (width!=self.cfg.SCR_WIDTH) or (height!=self.cfg.SCR_HEIGHT):
+            print("Wrong image size",width,height)
+        
+        # skip the palette
+        skip = max(start_pos-len(header),0)
+        if len(r.raw.read(skip))!=skip:
+            r.close()
+            return None
+        
+        self.led.off()
+        return (r,r.raw,self.get_etag(r))
             
             
 
@@ -1,11 +1,36 @@
 from p_weather.sprites import Sprites
-from p_weather.openweathermap import OpenWeatherMap, WeatherInfo
+from p_weather.openweathermap import OpenWeatherMap, ForecastColumns, WeatherInfo
 from p_weather.sunrise import sun
 
 import datetime
 from PIL import Image
 import random
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Union
+
+
+class TimelineSlot():
+
+    def __init__(self, t: datetime.datetime, f: WeatherInfo, x: int, sunrise: datetime.datetime, sunset: datetime.datetime):
+        self.t: datetime.datetime = t
+        self.f: WeatherInfo = f
+        self.x: int = x
+        self.sunrise: datetime.datetime = sunrise
+        self.sunset: datetime.datetime = sunset
+
+
+
+class ForecastTimeline():
+    """
+    Forecast slots of one drawing, resolved once: slot time, forecast entry,
+    x position and sunrise/sunset. Ends at the first slot with no forecast.
+    """
+
+    def __init__(self, t: datetime.datetime, dt: datetime.timedelta, curr: Optional[WeatherInfo]):
+        self.t: datetime.datetime = t
+        self.dt: datetime.timedelta = dt
+        self.curr: Optional[WeatherInfo] = curr
+        self.slots: List[TimelineSlot] = []
+
 
 
 class DrawWeather():
@@ -55,25 +80,29 @@ class DrawWeather():
     #todo: add fog
     #todo: add snow
 
-    def Draw(self, ypos: int, owm: OpenWeatherMap) -> None:
+    def MakeTimeline(self, owm: Union[OpenWeatherMap, ForecastColumns]) -> "ForecastTimeline":
+        nforecasrt: int = int( (self.picwidth-self.XSTART)/self.XSTEP )
+        t: datetime.datetime = datetime.datetime.now()
+        dt: datetime.timedelta = datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS)
+        s: sun = sun(owm.LAT,owm.LON)
 
-        self.picheight: int = self.IMGHEIGHT
-        self.picwidth: int = self.IMGEWIDTH
-        self.ypos: int = ypos
+        timeline: ForecastTimeline = ForecastTimeline(t,dt,owm.GetCurr())
+        times: List[datetime.datetime] = [ t + dt*i for i in range(nforecasrt+1) ]
+        xpos: int = self.XSTART
+        for tf, f in zip(times, owm.GetMany(times)):
+            if (f is None):
+                break
+            timeline.slots.append(TimelineSlot(tf,f,xpos,s.sunrise(tf),s.sunset(tf)))
+            xpos+=self.XSTEP
+        return timeline
 
-        nforecasrt: float = ( (self.picwidth-self.XSTART)/self.XSTEP )
-        maxtime: datetime.datetime = datetime.datetime.now() + datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS*nforecasrt)
 
-        # Manually iterate through temperatures to find min and max
+    def SetTempRange(self, timeline: "ForecastTimeline") -> None:
         self.tmin = float('inf')
         self.tmax = float('-inf')
-        current_time = datetime.datetime.now()
-        while current_time <= maxtime:
-            weather_info = owm.Get(current_time)
-            if weather_info is not None:
-                self.tmin = min(self.tmin, weather_info.temp)
-                self.tmax = max(self.tmax, weather_info.temp)
-            current_time += datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS)
+        for slot in timeline.slots:
+            self.tmin = min(self.tmin, slot.f.temp)
+            self.tmax = max(self.tmax, slot.f.temp)
         self.temprange: float = self.tmax-self.tmin
         if ( self.temprange < self.YSTEP ):
             self.degreeperpixel: float = self.DEFAULT_DEGREE_PER_PIXEL
@@ -82,40 +111,50 @@ class DrawWeather():
 
         #print("tmin = %f , tmax = %f, range=%f" % (self.tmin,self.tmax,self.temprange))
 
-        xpos: int = 0
+
+    def Draw(self, ypos: int, owm: Union[OpenWeatherMap, ForecastColumns]) -> None:
+
+        self.picheight: int = self.IMGHEIGHT
+        self.picwidth: int = self.IMGEWIDTH
+        self.ypos: int = ypos
+
+        timeline: ForecastTimeline = self.MakeTimeline(owm)
+        self.SetTempRange(timeline)
+
         tline: List[int] = [0]*(self.picwidth+self.XSTEP+1)
-        f: WeatherInfo | None = owm.GetCurr()
+        self.DrawCurrent(timeline, tline)
+        self.DrawTempLine(timeline, tline)
+        self.DrawSunMoon(timeline)
+        self.DrawForecast(timeline, tline)
+        self.DrawGround(tline)
+
+
+    def DrawCurrent(self, timeline: "ForecastTimeline", tline: List[int]) -> None:
+        xpos: int = 0
+        f: WeatherInfo | None = timeline.curr
         if f is None:
             raise ValueError("Could not get current weather information")
-        oldtemp: float = f.temp
-        oldy: int = self.DegToPix(oldtemp)
+        oldy: int = self.DegToPix(f.temp)
         for i in range(self.XSTART):
             tline[i] = oldy
-        yclouds: int = int(ypos-self.YSTEP/2)
+        yclouds: int = int(self.ypos-self.YSTEP/2)
         f.Print()
 
         self.sprite.Draw("house",xpos,0,oldy)
-        self.sprite.DrawInt(int(oldtemp),xpos+8,oldy+10)
+        self.sprite.DrawInt(int(f.temp),xpos+8,oldy+10)
         self.sprite.DrawCloud(f.clouds,xpos,yclouds,self.XSTART,int(self.YSTEP/2))
         self.sprite.DrawRain(f.rain,xpos,yclouds,self.XSTART,tline)
         self.sprite.DrawSnow(f.snow,xpos,yclouds,self.XSTART,tline)
 
 
-        t: datetime.datetime = datetime.datetime.now()
-        dt: datetime.timedelta = datetime.timedelta(hours=WeatherInfo.FORECAST_PERIOD_HOURS)
-        tf: datetime.datetime = t
-
-        xpos = int(self.XSTART)
-        nforecasrt = int(nforecasrt)
-
+    def DrawTempLine(self, timeline: "ForecastTimeline", tline: List[int]) -> None:
+        oldy: int = self.DegToPix(timeline.curr.temp)
+        xpos: int = self.XSTART
         n: int = int( (self.XSTEP-self.XFLAT)/2 )
-        for i in range(nforecasrt+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
+        for slot in timeline.slots:
+            f: WeatherInfo = slot.f
             f.Print()
-            newtemp: float = f.temp
-            newy: int = self.DegToPix(newtemp)
+            newy: int = self.DegToPix(f.temp)
             for i in range(n):
                 tline[xpos+i] = self.mybezier(xpos+i,xpos,oldy,xpos+n,newy)
 
@@ -127,57 +166,40 @@ class DrawWeather():
             xpos+=n+self.XFLAT
 
             n = (self.XSTEP-self.XFLAT)
-            oldtemp = newtemp
             oldy = newy
-            tf += dt
-
-        s: sun = sun(owm.LAT,owm.LON)
-        tf = t
-        xpos = self.XSTART
-        objcounter: int = 0
-        for i in range(nforecasrt+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
 
-            t_sunrise: datetime.datetime = s.sunrise(tf)
-            t_sunset: datetime.datetime = s.sunset(tf)
 
-            ymoon: int = ypos-self.YSTEP*5//8
+    def DrawSunMoon(self, timeline: "ForecastTimeline") -> None:
+        dt: datetime.timedelta = timeline.dt
+        ymoon: int = self.ypos-self.YSTEP*5//8
+        objcounter: int = 0
+        for slot in timeline.slots:
+            tf: datetime.datetime = slot.t
 
-            if (tf<=t_sunrise) and (tf+dt>t_sunrise):
-                dx: int = self.TimeDiffToPixels(t_sunrise-tf)  - self.XSTEP//2
-                self.sprite.Draw("sun",0,xpos+dx,ymoon)
+            if (tf<=slot.sunrise) and (tf+dt>slot.sunrise):
+                dx: int = self.TimeDiffToPixels(slot.sunrise-tf)  - self.XSTEP//2
+                self.sprite.Draw("sun",0,slot.x+dx,ymoon)
                 objcounter+=1
                 if (objcounter==2):
                     break
 
-            if (tf<=t_sunset) and (tf+dt>t_sunset):
-                dx = self.TimeDiffToPixels(t_sunset-tf)  - self.XSTEP//2
-                self.sprite.Draw("moon",0,xpos+dx,ymoon)
+            if (tf<=slot.sunset) and (tf+dt>slot.sunset):
+                dx = self.TimeDiffToPixels(slot.sunset-tf)  - self.XSTEP//2
+                self.sprite.Draw("moon",0,slot.x+dx,ymoon)
                 objcounter+=1
                 if (objcounter==2):
                     break
 
-            xpos+=self.XSTEP
-            tf += dt
-
-
 
+    def DrawForecast(self, timeline: "ForecastTimeline", tline: List[int]) -> None:
+        dt: datetime.timedelta = timeline.dt
         istminprinted: bool = False
         istmaxprinted: bool = False
-        tf = t
-        xpos = self.XSTART
-        n = int( (self.XSTEP-self.XFLAT)/2 )
-        for i in range(nforecasrt+1):
-            f = owm.Get(tf)
-            if (f==None):
-                continue
-
-            #f.Print()
-
-            yclouds = int( ypos-self.YSTEP/2 )
-
+        n: int = int( (self.XSTEP-self.XFLAT)/2 )
+        yclouds: int = int( self.ypos-self.YSTEP/2 )
+        for slot in timeline.slots:
+            f: WeatherInfo = slot.f
+            xpos: int = slot.x
 
             if (f.temp==self.tmin) and (not istminprinted):
                 self.sprite.DrawInt(int(f.temp), xpos+n, tline[xpos+n]+10)
@@ -223,20 +245,14 @@ class DrawWeather():
             self.sprite.DrawSnow(f.snow,xpos,yclouds,self.XSTEP,tline)
 
             # Draw rainbow if it's raining and there's sunlight (assuming daytime)
-            # if f.rain > 0 and 6 <= tf.hour <= 18 and random.random() < 0.7:  # 70% chance
+            # if f.rain > 0 and 6 <= slot.t.hour <= 18 and random.random() < 0.7:  # 70% chance
             if True:
                 rainbow_width: int = self.XSTEP * 2
                 rainbow_height: int = self.YSTEP
                 self.sprite.DrawRainbow(xpos, yclouds - rainbow_height)
 
-            xpos+=self.XSTEP
-            tf += dt
-
-
-
-
-        BLACK: int = 0
 
+    def DrawGround(self, tline: List[int]) -> None:
         for x in range(self.picwidth):
             if (tline[x]<self.picheight):
                 self.sprite.Dot(x,tline[x],Sprites.BLACK)
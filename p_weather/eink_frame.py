@@ -0,0 +1,113 @@
+import struct
+from typing import List, Optional
+
+from PIL import Image
+
+
+# Frame memory layout of the 2.9" e-paper panel (esp32/board/epaper2in9.py):
+# portrait 128x296, one bit per pixel, 1 is white, 16 bytes per line,
+# most significant bit leftmost, lines top to bottom
+FRAME_WIDTH: int = 128
+FRAME_HEIGHT: int = 296
+FRAME_BYTES_PER_LINE: int = FRAME_WIDTH // 8
+FRAME_SIZE: int = FRAME_BYTES_PER_LINE * FRAME_HEIGHT
+
+
+def PackFrame(img: Image.Image) -> bytes:
+    """
+    Pack a landscape 296x128 image into the bytes EPD.set_frame_memory
+    expects, the same pixels the device used to slice out of the BMP
+    """
+    if img.mode != "1":
+        img = img.convert("1")
+    frame: bytes = img.transpose(Image.ROTATE_270).tobytes()
+    if len(frame) != FRAME_SIZE:
+        raise ValueError("Wrong image size %ix%i" % img.size)
+    return frame
+
+
+# Frame delta: records of <HH first line, line count, followed by the
+# new bytes of those lines. A delta against no base covers every line.
+DELTA_RECORD: str = "<HH"
+
+
+def FrameDelta(base: Optional[bytes], frame: bytes) -> bytes:
+    """
+    Encode the runs of lines of frame that differ from base
+    """
+    bpl: int = FRAME_BYTES_PER_LINE
+    if base is None:
+        return struct.pack(DELTA_RECORD, 0, FRAME_HEIGHT) + frame
+
+    out: List[bytes] = []
+    line: int = 0
+    while line < FRAME_HEIGHT:
+        if base[line*bpl:(line+1)*bpl] == frame[line*bpl:(line+1)*bpl]:
+            line += 1
+            continue
+        first: int = line
+        while (line < FRAME_HEIGHT) and (base[line*bpl:(line+1)*bpl] != frame[line*bpl:(line+1)*bpl]):
+            line += 1
+        out.append(struct.pack(DELTA_RECORD, first, line - first))
+        out.append(frame[first*bpl:line*bpl])
+    return b"".join(out)
+
+
+def ApplyFrameDelta(base: Optional[bytes], delta: bytes) -> bytes:
+    bpl: int = FRAME_BYTES_PER_LINE
+    frame: bytearray = bytearray(base) if base is not None else bytearray(b"\xFF" * FRAME_SIZE)
+    pos: int = 0
+    recsize: int = struct.calcsize(DELTA_RECORD)
+    while pos < len(delta):
+        first, count = struct.unpack_from(DELTA_RECORD, delta, pos)
+        pos += recsize
+        lines: bytes = delta[pos:pos+count*bpl]
+        if (first + count > FRAME_HEIGHT) or (len(lines) != count*bpl):
+            raise ValueError("Bad delta record: lines %i+%i" % (first, count))
+        frame[first*bpl:(first+count)*bpl] = lines
+        pos += count*bpl
+    return bytes(frame)
+
+
+def PackBits(data: bytes) -> bytes:
+    """
+    PackBits run-length coding: a header byte n, then n+1 literal bytes
+    for n < 128, or one byte repeated 257-n times for n > 128. Decodes
+    with a two byte state, small enough for the device.
+    """
+    out: bytearray = bytearray()
+    n: int = len(data)
+    i: int = 0
+    while i < n:
+        run: int = 1
+        while (i + run < n) and (run < 128) and (data[i + run] == data[i]):
+            run += 1
+        if run >= 2:
+            out.append(257 - run)
+            out.append(data[i])
+            i += run
+            continue
+        # literals up to the next run of three (a run of two costs as much)
+        start: int = i
+        while (i < n) and (i - start < 128):
+            if (i + 2 < n) and (data[i] == data[i + 1] == data[i + 2]):
+                break
+            i += 1
+        out.append(i - start - 1)
+        out += data[start:i]
+    return bytes(out)
+
+
+def UnpackBits(data: bytes) -> bytes:
+    out: bytearray = bytearray()
+    i: int = 0
+    while i < len(data):
+        n: int = data[i]
+        i += 1
+        if n < 128:
+            out += data[i:i + n + 1]
+            i += n + 1
+        elif n > 128:
+            out += data[i:i + 1] * (257 - n)
+            i += 1
+    return bytes(out)
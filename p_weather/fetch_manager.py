@@ -0,0 +1,154 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from p_weather.openweathermap import OpenWeatherMap
+
+
+class TokenBucket():
+
+    def __init__(self, rate_per_sec: float, capacity: float) -> None:
+        self.rate: float = rate_per_sec
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.t: float = time.monotonic()
+
+    def Refill(self) -> None:
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+
+    def Take(self, n: float) -> float:
+        """
+        Take n tokens if available and return 0, otherwise take nothing
+        and return the number of seconds until they will be.
+        """
+        self.Refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+
+class InFlightFetch():
+
+    def __init__(self, owm: OpenWeatherMap) -> None:
+        self.owm: OpenWeatherMap = owm
+        self.done: bool = False
+        self.result: bool = False
+        self.error: Optional[BaseException] = None
+
+
+
+class OpenWeatherFetchManager():
+    """
+    Shared gate for OpenWeather API calls of all OpenWeatherMap objects.
+
+    Concurrent fetches of the same place are coalesced into one. API calls
+    are limited by a token bucket; when it is empty, waiting fetches are
+    served stalest cache first.
+    """
+
+    CALLS_PER_MINUTE: int = 60
+    BURST: int = 10
+    CALLS_PER_FETCH: int = 2 # forecast and current weather
+
+    def __init__(self, callsperminute: float = CALLS_PER_MINUTE, burst: int = BURST) -> None:
+        self.bucket: TokenBucket = TokenBucket(callsperminute / 60.0, max(burst, self.CALLS_PER_FETCH))
+        self.cond: threading.Condition = threading.Condition()
+        self.inflight: Dict[str, InFlightFetch] = {}
+        self.queue: List[Tuple[float, int, str]] = []
+        self.seq = itertools.count()
+
+        self.calls_made: int = 0
+        self.calls_saved: int = 0
+        self.throttled_waits: int = 0
+        self.throttled_sec: float = 0.0
+
+    @staticmethod
+    def Staleness(owm: OpenWeatherMap) -> float:
+        try:
+            return time.time() - os.stat(owm.filename_forecast).st_mtime
+        except OSError:
+            return float("inf")
+
+    def Fetch(self, owm: OpenWeatherMap) -> bool:
+        # the cache file name identifies the place (and cache directory)
+        key: str = owm.filename_forecast
+
+        with self.cond:
+            fetch: Optional[InFlightFetch] = self.inflight.get(key)
+            if fetch is not None:
+                self.calls_saved += self.CALLS_PER_FETCH
+                while not fetch.done:
+                    self.cond.wait()
+                if fetch.error is not None:
+                    raise fetch.error
+                owm.f = fetch.owm.f
+                owm.MakeIndex()
+                return fetch.result
+
+            fetch = InFlightFetch(owm)
+            self.inflight[key] = fetch
+
+        try:
+            fetch.result = owm.Refresh(lambda: self.FromWWW(key, owm))
+            return fetch.result
+        except BaseException as e:
+            fetch.error = e
+            raise
+        finally:
+            with self.cond:
+                fetch.done = True
+                del self.inflight[key]
+                self.cond.notify_all()
+
+    def FromWWW(self, key: str, owm: OpenWeatherMap) -> bool:
+        with self.cond:
+            self.WaitForTurn(key, self.Staleness(owm))
+        return owm.FromWWW()
+
+    def TakeTurn(self, owm: OpenWeatherMap) -> None:
+        """
+        Wait for the token bucket and count the calls of one fetch of owm,
+        for fetchers that make the API calls themselves (see owm_async)
+        """
+        with self.cond:
+            self.WaitForTurn(owm.filename_forecast, self.Staleness(owm))
+
+    def WaitForTurn(self, key: str, staleness: float) -> None:
+        # called holding self.cond
+        entry: Tuple[float, int, str] = (-staleness, next(self.seq), key)
+        heapq.heappush(self.queue, entry)
+        throttled: bool = False
+        t0: float = time.monotonic()
+        while True:
+            if self.queue[0] is entry:
+                wait: float = self.bucket.Take(self.CALLS_PER_FETCH)
+                if wait == 0.0:
+                    heapq.heappop(self.queue)
+                    self.calls_made += self.CALLS_PER_FETCH
+                    self.cond.notify_all()
+                    break
+            else:
+                wait = 1.0
+            throttled = True
+            self.cond.wait(wait)
+        if throttled:
+            self.throttled_waits += 1
+            self.throttled_sec += time.monotonic() - t0
+
+    def Stats(self) -> Dict[str, float]:
+        with self.cond:
+            return {
+                "calls_made": self.calls_made,
+                "calls_saved": self.calls_saved,
+                "throttled_waits": self.throttled_waits,
+                "throttled_sec": round(self.throttled_sec, 3),
+                "inflight": len(self.inflight),
+                "queued": len(self.queue),
+            }
@@ -0,0 +1,86 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# The umask can only be read by setting it, which is not safe once other
+# threads create files, so it is read once at import
+UMASK: int = os.umask(0)
+os.umask(UMASK)
+
+
+@contextmanager
+def AtomicPath(path: str) -> Iterator[str]:
+    """
+    Yield a temporary file name next to path; once the block succeeds the
+    file replaces path in one step, so readers see the old or the new
+    file, never a partly written one.
+    """
+    dirname, filename = os.path.split(path)
+    suffix: str = os.path.splitext(filename)[1]
+    fd, tmppath = tempfile.mkstemp(prefix="." + filename + ".", suffix=suffix, dir=dirname or ".")
+    os.close(fd)
+    try:
+        yield tmppath
+        # mkstemp creates the file private (0600), give it the mode open() would
+        os.chmod(tmppath, 0o666 & ~UMASK)
+        os.replace(tmppath, path)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def AtomicWrite(path: str, data: bytes) -> None:
+    with AtomicPath(path) as tmppath:
+        with open(tmppath, "wb") as f:
+            f.write(data)
+
+
+
+class FileLock():
+    """
+    Exclusive lock on a lock file, held across threads and processes
+    for the duration of a with block.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.f: Optional[object] = None
+
+    def __enter__(self) -> "FileLock":
+        f = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after about 10 seconds
+                        pass
+        except BaseException:
+            f.close()
+            raise
+        self.f = f
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        f = self.f
+        self.f = None
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
@@ -1,15 +1,23 @@
 import os
 import time
 import json
+import struct
 import datetime
-from typing import List, Tuple, Optional
+import math
+from array import array
+from bisect import bisect_right
+from typing import Any, Callable, Iterable, List, Tuple, Optional
 from urllib.request import urlopen
 
+from p_weather.fileutil import AtomicWrite, FileLock
+
 
 
 
 class WeatherInfo():
 
+    __slots__ = ("dt", "t", "id", "clouds", "rain", "snow", "windspeed", "winddeg", "temp")
+
     KTOC: float = 273.15
 
     Thunderstorm: int = 2
@@ -23,7 +31,8 @@ class WeatherInfo():
 
 
     def __init__(self, fdata: dict) -> None:
-        self.t: datetime.datetime = datetime.datetime.fromtimestamp(int(fdata['dt']))
+        self.dt: int = int(fdata['dt'])
+        self.t: datetime.datetime = datetime.datetime.fromtimestamp(self.dt)
         self.id: int = int(fdata['weather'][0]['id'])
 
         if ('clouds' in fdata) and ('all' in fdata['clouds']):
@@ -55,6 +64,23 @@ class WeatherInfo():
         self.temp: float = float(fdata['main']['temp']) - WeatherInfo.KTOC
 
 
+    @staticmethod
+    def FromValues(dt: int, id: int, clouds: int, rain: float, snow: float, windspeed: float, winddeg: float, temp: float) -> "WeatherInfo":
+        f: WeatherInfo = WeatherInfo.__new__(WeatherInfo)
+        f.dt = dt
+        f.t = datetime.datetime.fromtimestamp(dt)
+        f.id = id
+        f.clouds = clouds
+        f.rain = rain
+        f.snow = snow
+        f.windspeed = windspeed
+        f.winddeg = winddeg
+        f.temp = temp
+        return f
+
+    def Values(self) -> Tuple[int, int, int, float, float, float, float, float]:
+        return (self.dt,self.id,self.clouds,self.rain,self.snow,self.windspeed,self.winddeg,self.temp)
+
     def Print(self) -> None:
         print("%s %i %03i%%  %.2f %.2f  %+.2f (%5.1f,%03i)"  % (str(self.t),self.id,self.clouds,self.rain,self.snow,self.temp,self.windspeed,self.winddeg)  )
 
@@ -71,6 +97,97 @@ class WeatherInfo():
 
 
 
+class ForecastColumns():
+    """
+    Compact forecast of one place: WeatherInfo fields as parallel arrays
+    instead of one object per entry. Get, GetMany, GetCurr and GetTempRange
+    behave like the OpenWeatherMap ones, returning WeatherInfo objects
+    made on demand, so it can be passed to DrawWeather in place of one.
+    """
+
+    EPOCH: datetime.datetime = datetime.datetime(1970,1,1)
+
+    def __init__(self, latitude: float, longitude: float, forecast: Iterable[WeatherInfo]) -> None:
+        self.latitude: float = latitude
+        self.longitude: float = longitude
+        self.dt: array = array('q')
+        self.id: array = array('i')
+        self.clouds: array = array('i')
+        self.rain: array = array('d')
+        self.snow: array = array('d')
+        self.windspeed: array = array('d')
+        self.winddeg: array = array('d')
+        self.temp: array = array('d')
+        # local wall-clock seconds, so lookups compare like naive WeatherInfo.t
+        self.wall: array = array('q')
+        for f in forecast:
+            self.dt.append(f.dt)
+            self.id.append(f.id)
+            self.clouds.append(f.clouds)
+            self.rain.append(f.rain)
+            self.snow.append(f.snow)
+            self.windspeed.append(f.windspeed)
+            self.winddeg.append(f.winddeg)
+            self.temp.append(f.temp)
+            self.wall.append(int(self.WallSeconds(f.t)))
+
+        # see OpenWeatherMap.MakeIndex
+        self.index_wall: array = array('q')
+        self.index_pos: array = array('i')
+        for i, w in enumerate(self.wall):
+            if (len(self.index_wall)==0) or (w>self.index_wall[-1]):
+                self.index_wall.append(w)
+                self.index_pos.append(i)
+
+    @staticmethod
+    def WallSeconds(t: datetime.datetime) -> float:
+        return (t - ForecastColumns.EPOCH).total_seconds()
+
+    @property
+    def LAT(self)->float:
+        return self.latitude
+
+    @property
+    def LON(self)->float:
+        return self.longitude
+
+    def __len__(self) -> int:
+        return len(self.dt)
+
+    def Item(self, i: int) -> WeatherInfo:
+        return WeatherInfo.FromValues(self.dt[i],self.id[i],self.clouds[i],self.rain[i],self.snow[i],
+                                      self.windspeed[i],self.winddeg[i],self.temp[i])
+
+    def GetCurr(self) -> Optional[WeatherInfo]:
+        if len(self.dt)==0:
+            return None
+        return self.Item(0)
+
+    def Get(self,time: datetime.datetime) -> Optional[WeatherInfo]:
+        i: int = bisect_right(self.index_wall,self.WallSeconds(time))
+        if i==len(self.index_pos):
+            return None
+        return self.Item(self.index_pos[i])
+
+    def GetMany(self,times: Iterable[datetime.datetime]) -> List[Optional[WeatherInfo]]:
+        return [ self.Get(time) for time in times ]
+
+    def GetTempRange(self,maxtime: datetime.datetime) -> Optional[Tuple[float, float]]:
+        if len(self.dt)==0:
+            return None
+        tmax: float = -999
+        tmin: float = 999
+        maxwall: float = self.WallSeconds(maxtime)
+        for i in range(1,len(self.dt)):
+            if (self.wall[i]>maxwall):
+                break
+            tmax = max(tmax,self.temp[i])
+            tmin = min(tmin,self.temp[i])
+        return (tmin,tmax)
+
+
+
+
 class OpenWeatherMap():
 
     OWMURL: str = "http://api.openweathermap.org/data/2.5/"
@@ -80,25 +197,60 @@ class OpenWeatherMap():
     FILENAME_FORECAST: str = "openweathermap_fcst_"
     FILENAME_EXT: str = ".json"
 
+    # Parsed forecast snapshot next to the JSON cache: a header and one
+    # fixed-width record per WeatherInfo, loaded without JSON parsing
+    BINARY_CACHE: bool = False
+    FILENAME_BINARY: str = "openweathermap_snap_"
+    FILENAME_BINARY_EXT: str = ".bin"
+    BINARY_MAGIC: bytes = b"OWMS"
+    BINARY_VERSION: int = 1
+    BINARY_HEADER: struct.Struct = struct.Struct("<4sHI")
+    BINARY_RECORD: struct.Struct = struct.Struct("<qiiddddd")
+
+    # Held while a place is refreshed, across threads and processes
+    FILENAME_LOCK: str = "openweathermap_"
+    FILENAME_LOCK_EXT: str = ".lock"
+
     FILETOOOLD_SEC: int = 15*60 # 15 mins
     TOOMUCHTIME_SEC: int = 4*60*60 # 4 hours
 
-    def __init__(self,apikey:str,latitude:float,longitude:float,rootdir:str="") -> None:
+    # Optional shared p_weather.fetch_manager.OpenWeatherFetchManager,
+    # used by FromAuto to coalesce and rate limit API calls
+    FETCHMANAGER: Any = None
+
+    # Size of the grid cells the forecast cache is shared in, 0 to disable.
+    # Places in one cell fetch and cache the forecast of the cell center.
+    CACHE_GRID_KM: float = 0.0
+    KM_PER_DEGREE: float = 111.32
+
+    def __init__(self,apikey:str,latitude:float,longitude:float,rootdir:str="",owmurl:Optional[str]=None,gridkm:Optional[float]=None) -> None:
 
         self.latitude: float = latitude
         self.longitude: float = longitude
 
-        reqstr: str = "lat=%.4f&lon=%.4f&mode=json&APPID=%s" % (self.LAT,self.LON,apikey)
-        self.URL_FOREAST: str = self.OWMURL+"forecast?"+reqstr
-        self.URL_CURR: str =  self.OWMURL+"weather?"+reqstr
+        if gridkm is None:
+            gridkm = self.CACHE_GRID_KM
+        self.fetch_latitude: float
+        self.fetch_longitude: float
+        self.fetch_latitude, self.fetch_longitude = OpenWeatherMap.SnapToGrid(latitude,longitude,gridkm)
+
+        if owmurl is None:
+            owmurl = self.OWMURL
+        reqstr: str = "lat=%.4f&lon=%.4f&mode=json&APPID=%s" % (self.fetch_latitude,self.fetch_longitude,apikey)
+        self.URL_FOREAST: str = owmurl+"forecast?"+reqstr
+        self.URL_CURR: str =  owmurl+"weather?"+reqstr
         self.f: List[WeatherInfo] = []
+        self.index_t: List[datetime.datetime] = []
+        self.index_f: List[WeatherInfo] = []
         self.rootdir: str = rootdir
 
         if not os.path.exists(self.rootdir):
             os.makedirs(self.rootdir)
 
-        self.filename_forecast: str = os.path.join(self.rootdir,self.FILENAME_FORECAST+self.PLACEKEY+self.FILENAME_EXT)
-        self.filename_curr: str = os.path.join(self.rootdir,self.FILENAME_CURR+self.PLACEKEY+self.FILENAME_EXT)
+        self.filename_forecast: str = os.path.join(self.rootdir,self.FILENAME_FORECAST+self.CACHEKEY+self.FILENAME_EXT)
+        self.filename_curr: str = os.path.join(self.rootdir,self.FILENAME_CURR+self.CACHEKEY+self.FILENAME_EXT)
+        self.filename_binary: str = os.path.join(self.rootdir,self.FILENAME_BINARY+self.CACHEKEY+self.FILENAME_BINARY_EXT)
+        self.filename_lock: str = os.path.join(self.rootdir,self.FILENAME_LOCK+self.CACHEKEY+self.FILENAME_LOCK_EXT)
 
     @property
     def LAT(self)->float:
@@ -117,22 +269,102 @@ class OpenWeatherMap():
     def PLACEKEY(self)->str:
         return  OpenWeatherMap.MakePlaceKey(self.LAT,self.LON)
 
+    @property
+    def CACHEKEY(self)->str:
+        return  OpenWeatherMap.MakePlaceKey(self.fetch_latitude,self.fetch_longitude)
+
+    @staticmethod
+    def SnapToGrid(latitude:float,longitude:float,gridkm:float) -> Tuple[float, float]:
+        if gridkm<=0:
+            return (latitude,longitude)
+        latstep: float = gridkm / OpenWeatherMap.KM_PER_DEGREE
+        lat: float = max(-90.0, min(90.0, round(latitude/latstep)*latstep))
+        # keep cells about gridkm wide away from the equator too
+        lonstep: float = latstep / max(math.cos(math.radians(lat)), latstep/360.0)
+        lon: float = round(longitude/lonstep)*lonstep
+        if lon>180.0:
+            lon -= 360.0
+        elif lon<-180.0:
+            lon += 360.0
+        return (lat,lon)
+
     @staticmethod
     def MakePlaceKey(latitude:float,longitude:float) -> str:
         return  OpenWeatherMap.MakeCoordinateKey(latitude) + OpenWeatherMap.MakeCoordinateKey(longitude)
 
+    @staticmethod
+    def ParseCoordinateKey(key:str) -> float:
+        n: int = int(key,16)
+        if n>=(1 << 23):
+            n -= (1 << 24)
+        # half a unit away from zero, so MakeCoordinateKey truncates back to n
+        return (n + (0.5 if n>=0 else -0.5)) / 10000
+
+    @staticmethod
+    def ParsePlaceKey(placekey:str) -> Tuple[float, float]:
+        if (len(placekey)!=12) or any(c not in "0123456789ABCDEFabcdef" for c in placekey):
+            raise ValueError("Invalid place key '%s'" % placekey)
+        latitude: float = OpenWeatherMap.ParseCoordinateKey(placekey[:6])
+        longitude: float = OpenWeatherMap.ParseCoordinateKey(placekey[6:])
+        # compared as MakeCoordinateKey truncates them: -90..90 and -180..180
+        if (abs(int(latitude*10000))>900000) or (abs(int(longitude*10000))>1800000):
+            raise ValueError("Place key '%s' out of range" % placekey)
+        return (latitude, longitude)
+
     def FromWWW(self) -> bool:
         fjsontext: bytes = urlopen(self.URL_FOREAST).read()
-        ff = open(self.filename_forecast,"wb")
-        ff.write(fjsontext)
-        ff.close()
-        fdata: dict = json.loads(fjsontext)
         cjsontext: bytes = urlopen(self.URL_CURR).read()
-        cf = open(self.filename_curr,"wb")
-        cf.write(cjsontext)
-        cf.close()
+        return self.FromText(cjsontext,fjsontext)
+
+
+    def FromText(self,cjsontext:bytes,fjsontext:bytes) -> bool:
+        fdata: dict = json.loads(fjsontext)
         cdata: dict = json.loads(cjsontext)
-        return self.FromJSON(cdata,fdata)
+        AtomicWrite(self.filename_forecast,fjsontext)
+        AtomicWrite(self.filename_curr,cjsontext)
+        result: bool = self.FromJSON(cdata,fdata)
+        if result and self.BINARY_CACHE:
+            self.SaveBinary()
+        return result
+
+
+    def ToBinary(self) -> bytes:
+        data: bytearray = bytearray(self.BINARY_HEADER.pack(self.BINARY_MAGIC,self.BINARY_VERSION,len(self.f)))
+        for f in self.f:
+            data += self.BINARY_RECORD.pack(*f.Values())
+        return bytes(data)
+
+
+    def FromBinary(self,data:bytes) -> bool:
+        # a short or corrupt snapshot is not used, FromFile falls back to JSON
+        if len(data)<self.BINARY_HEADER.size:
+            return False
+        magic, version, count = self.BINARY_HEADER.unpack_from(data)
+        if (magic!=self.BINARY_MAGIC) or (version!=self.BINARY_VERSION):
+            return False
+        records = memoryview(data)[self.BINARY_HEADER.size:self.BINARY_HEADER.size+count*self.BINARY_RECORD.size]
+        if len(records)!=count*self.BINARY_RECORD.size:
+            return False
+        try:
+            f: List[WeatherInfo] = [ WeatherInfo.FromValues(*values) for values in self.BINARY_RECORD.iter_unpack(records) ]
+        except (ValueError, OverflowError, OSError):
+            # timestamp out of range
+            return False
+        self.f = f
+        self.MakeIndex()
+        return True
+
+
+    def SaveBinary(self) -> None:
+        AtomicWrite(self.filename_binary,self.ToBinary())
+
+
+    def IsBinaryCurrent(self) -> bool:
+        # the snapshot must not be older than the JSON it was made from
+        try:
+            return os.stat(self.filename_binary).st_mtime >= os.stat(self.filename_forecast).st_mtime
+        except OSError:
+            return False
 
 
 
@@ -169,11 +401,31 @@ class OpenWeatherMap():
                 continue
             f = WeatherInfo(fdata)
             self.f.append(f)
+        self.MakeIndex()
         return True
 
 
+    def MakeIndex(self) -> None:
+        # Entries whose time exceeds every earlier entry, in list order.
+        # The first of them after t is the first entry of self.f after t,
+        # so Get() keeps the linear scan semantics even if self.f is unsorted.
+        self.index_t = []
+        self.index_f = []
+        for f in self.f:
+            if (len(self.index_t)==0) or (f.t>self.index_t[-1]):
+                self.index_t.append(f.t)
+                self.index_f.append(f)
+
+
 
     def FromFile(self) -> bool:
+        if self.BINARY_CACHE and self.IsBinaryCurrent():
+            bf = open(self.filename_binary,"rb")
+            data: bytes = bf.read()
+            bf.close()
+            if self.FromBinary(data):
+                return True
+
         ff = open(self.filename_forecast)
         fdata: dict = json.load(ff)
         ff.close()
@@ -181,19 +433,62 @@ class OpenWeatherMap():
         cdata: dict = json.load(cf)
         cf.close()
 
-        return self.FromJSON(cdata,fdata)
+        result: bool = self.FromJSON(cdata,fdata)
+        if result and self.BINARY_CACHE:
+            self.SaveBinary()
+        return result
 
     def IsFileTooOld(self, filename: str) -> bool:
         return (not os.path.isfile(filename)) or ( (time.time() - os.stat(filename).st_mtime) > self.FILETOOOLD_SEC )
 
+    def IsCacheTooOld(self) -> bool:
+        return self.IsFileTooOld(self.filename_forecast) or self.IsFileTooOld(self.filename_curr)
+
+    def CacheStamp(self) -> Optional[Tuple[int, int]]:
+        """
+        Modification times of the cache files, None if one is missing.
+        Every refresh replaces the files, so an equal stamp means equal data.
+        """
+        try:
+            return (os.stat(self.filename_forecast).st_mtime_ns, os.stat(self.filename_curr).st_mtime_ns)
+        except OSError:
+            return None
+
+    def NextUpdateTime(self, forecast: Any = None) -> float:
+        """
+        Unix time of the next change of the data: the cache expiry or the
+        start of the next forecast slot, whichever comes first. forecast is
+        the loaded data if not held by this object, e.g. ForecastColumns.
+        """
+        now: float = time.time()
+        updates: List[float] = []
+        for filename in (self.filename_forecast, self.filename_curr):
+            if os.path.isfile(filename):
+                updates.append(os.stat(filename).st_mtime + self.FILETOOOLD_SEC)
+        f: Optional[WeatherInfo] = (self if forecast is None else forecast).Get(datetime.datetime.fromtimestamp(now))
+        if f is not None:
+            updates.append(float(f.dt))
+        return max(now, min(updates)) if updates else now
+
     def FromAuto(self) -> bool:
-        if (self.IsFileTooOld(self.filename_forecast) or self.IsFileTooOld(self.filename_curr)):
-            print("Using WWW")
-            return self.FromWWW()
+        if self.IsCacheTooOld():
+            if self.FETCHMANAGER is not None:
+                return self.FETCHMANAGER.Fetch(self)
+            return self.Refresh()
 
         print("Using Cache '%s','%s'" % (self.filename_curr,self.filename_forecast))
         return self.FromFile()
 
+    def Refresh(self, fetch: Optional[Callable[[], bool]] = None) -> bool:
+        # One process refreshes a place at a time; the others wait for it
+        # and then read the files it wrote instead of fetching again
+        with FileLock(self.filename_lock):
+            if not self.IsCacheTooOld():
+                print("Using Cache refreshed by another process '%s'" % self.filename_forecast)
+                return self.FromFile()
+            print("Using WWW")
+            return self.FromWWW() if fetch is None else fetch()
+
     def GetCurr(self) -> Optional[WeatherInfo]:
         if len(self.f)==0:
             return None
@@ -201,11 +496,30 @@ class OpenWeatherMap():
 
 
     def Get(self,time: datetime.datetime) -> Optional[WeatherInfo]:
-        for f in self.f:
-            if (f.t>time):
-                return f
-        return None
+        i: int = bisect_right(self.index_t,time)
+        if i==len(self.index_f):
+            return None
+        return self.index_f[i]
+
+
+    def GetMany(self,times: Iterable[datetime.datetime]) -> List[Optional[WeatherInfo]]:
+        result: List[Optional[WeatherInfo]] = []
+        n: int = len(self.index_t)
+        i: int = 0
+        prev: Optional[datetime.datetime] = None
+        for t in times:
+            if (prev is not None) and (t<prev):
+                i = bisect_right(self.index_t,t)
+            while (i<n) and (self.index_t[i]<=t):
+                i+=1
+            result.append(self.index_f[i] if i<n else None)
+            prev = t
+        return result
+
+
 
+    def ToColumns(self) -> ForecastColumns:
+        return ForecastColumns(self.LAT,self.LON,self.f)
 
 
     def PrintAll(self) -> None:
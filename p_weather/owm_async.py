@@ -0,0 +1,286 @@
+import asyncio
+import ssl
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from p_weather.openweathermap import OpenWeatherMap
+from p_weather.fileutil import FileLock
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status: int, url: str) -> None:
+        super().__init__("HTTP %i for %s" % (status, url))
+        self.status: int = status
+        self.url: str = url
+
+
+
+class AsyncConnectionPool():
+    """
+    Keep-alive HTTP/1.1 connections to one host, reused between requests.
+    Only what the OpenWeather API needs: GET, Content-Length or chunked bodies.
+    """
+
+    def __init__(self, scheme: str, host: str, port: int, maxidle: int = 8) -> None:
+        self.scheme: str = scheme
+        self.host: str = host
+        self.port: int = port
+        self.maxidle: int = maxidle
+        self.idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def Connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        sslctx: Optional[ssl.SSLContext] = ssl.create_default_context() if self.scheme == "https" else None
+        return await asyncio.open_connection(self.host, self.port, ssl=sslctx)
+
+    async def Get(self, path: str) -> Tuple[int, bytes]:
+        while self.idle:
+            conn = self.idle.pop()
+            try:
+                return await self.Request(conn, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # the server closed the idle connection, try the next one
+                conn[1].close()
+        return await self.Request(await self.Connect(), path)
+
+    async def Request(self, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter], path: str) -> Tuple[int, bytes]:
+        reader, writer = conn
+        try:
+            writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n"
+                          "Accept-Encoding: identity\r\n\r\n" % (path, self.host)).encode("latin-1"))
+            await writer.drain()
+
+            statusline: bytes = await reader.readuntil(b"\r\n")
+            status: int = int(statusline.split()[1])
+            headers: Dict[str, str] = {}
+            while True:
+                line: bytes = await reader.readuntil(b"\r\n")
+                if line == b"\r\n":
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keepalive: bool = headers.get("connection", "").lower() != "close"
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                body: bytes = await self.ReadChunked(reader)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+                keepalive = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if keepalive and len(self.idle) < self.maxidle:
+            self.idle.append(conn)
+        else:
+            writer.close()
+        return (status, body)
+
+    @staticmethod
+    async def ReadChunked(reader: asyncio.StreamReader) -> bytes:
+        body: bytearray = bytearray()
+        while True:
+            size: int = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                    pass
+                return bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+    async def Close(self) -> None:
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+
+class AsyncOpenWeatherFetcher():
+    """
+    Fetches OpenWeather data for many OpenWeatherMap objects at once.
+    Forecast and current weather of a place are requested concurrently,
+    over connections kept alive per host, with at most CONCURRENCY places
+    in flight, a timeout per request and retries with exponential backoff.
+    """
+
+    CONCURRENCY: int = 8
+    TIMEOUT_SEC: float = 10.0
+    RETRIES: int = 3
+    BACKOFF_SEC: float = 0.5
+
+    def __init__(self, concurrency: int = CONCURRENCY, timeout: float = TIMEOUT_SEC,
+                 retries: int = RETRIES, backoff: float = BACKOFF_SEC) -> None:
+        self.concurrency: int = concurrency
+        self.timeout: float = timeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.pools: Dict[Tuple[str, str, int], AsyncConnectionPool] = {}
+        # by lock file name, see Fetch
+        self.placelocks: Dict[str, asyncio.Lock] = {}
+
+    def Pool(self, scheme: str, host: str, port: int) -> AsyncConnectionPool:
+        key: Tuple[str, str, int] = (scheme, host, port)
+        if key not in self.pools:
+            self.pools[key] = AsyncConnectionPool(scheme, host, port, maxidle=2*self.concurrency)
+        return self.pools[key]
+
+    async def GetBytes(self, url: str) -> bytes:
+        u = urlsplit(url)
+        port: int = u.port or (443 if u.scheme == "https" else 80)
+        pool: AsyncConnectionPool = self.Pool(u.scheme, u.hostname or "", port)
+        path: str = (u.path or "/") + ("?" + u.query if u.query else "")
+
+        attempt: int = 0
+        while True:
+            try:
+                status, body = await asyncio.wait_for(pool.Get(path), self.timeout)
+                if status == 200:
+                    return body
+                error: Exception = HTTPError(status, url)
+                # other client errors will not go away by retrying
+                if (400 <= status < 500) and (status != 429):
+                    raise error
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                error = e
+            attempt += 1
+            if attempt > self.retries:
+                raise error
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)))
+
+    async def Fetch(self, owm: OpenWeatherMap) -> bool:
+        # Same rules as OpenWeatherMap.Refresh: one refresh of a place at a
+        # time across threads and processes, the cache another one wrote is
+        # used as is, and API calls wait for OpenWeatherMap.FETCHMANAGER.
+        # The blocking waits run in the executor, off the event loop. Fetches
+        # of the same place here wait on the event loop instead: blocked in
+        # the file lock they could take every executor thread, and the one
+        # holding it would never get one for TakeTurn.
+        placelock: asyncio.Lock = self.placelocks.setdefault(owm.filename_lock, asyncio.Lock())
+        async with placelock:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            lock: FileLock = FileLock(owm.filename_lock)
+            await loop.run_in_executor(None, lock.__enter__)
+            try:
+                if not owm.IsCacheTooOld():
+                    return owm.FromFile()
+                if owm.FETCHMANAGER is not None:
+                    await loop.run_in_executor(None, owm.FETCHMANAGER.TakeTurn, owm)
+                ctext, ftext = await asyncio.gather(self.GetBytes(owm.URL_CURR), self.GetBytes(owm.URL_FOREAST))
+                return owm.FromText(ctext, ftext)
+            finally:
+                lock.__exit__(None, None, None)
+
+    async def FetchMany(self, owms: List[OpenWeatherMap]) -> List[Optional[Exception]]:
+        """
+        Fetch every place, returning None or the error for each of them
+        """
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetchone(owm: OpenWeatherMap) -> Optional[Exception]:
+            async with semaphore:
+                try:
+                    await self.Fetch(owm)
+                    return None
+                except Exception as e:
+                    return e
+
+        return list(await asyncio.gather(*[ fetchone(owm) for owm in owms ]))
+
+    async def Close(self) -> None:
+        for pool in self.pools.values():
+            await pool.Close()
+        self.pools = {}
+        self.placelocks = {}
+
+    @staticmethod
+    def Run(owms: List[OpenWeatherMap], **kwargs) -> List[Optional[Exception]]:
+        async def run() -> List[Optional[Exception]]:
+            fetcher: AsyncOpenWeatherFetcher = AsyncOpenWeatherFetcher(**kwargs)
+            try:
+                return await fetcher.FetchMany(owms)
+            finally:
+                await fetcher.Close()
+        return asyncio.run(run())
+
+
+
+if __name__ == "__main__":
+
+    # check against a local stub standing in for api.openweathermap.org
+    import json
+    import tempfile
+    import threading
+    import time
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    connections: List[int] = []
+    requests: List[str] = []
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(1)
+
+        def do_GET(self):
+            requests.append(self.path)
+            if ("lat=0.0000" in self.path) and (requests.count(self.path) == 1):
+                status, body = 503, b"busy"
+            elif "lat=1.0000" in self.path:
+                status, body = 401, b"{}"
+            elif self.path.startswith("/weather"):
+                status, body = 200, json.dumps({"dt": int(time.time()), "weather": [{"id": 800}], "main": {"temp": 283.15}}).encode()
+            else:
+                status, body = 200, json.dumps({"list": [{"dt": int(time.time()) + 3600 * 3 * i, "weather": [{"id": 500}],
+                                                          "main": {"temp": 280.15 + i}} for i in range(1, 41)]}).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    stuburl = "http://127.0.0.1:%i/" % httpd.server_address[1]
+
+    from concurrent.futures import ThreadPoolExecutor
+    from p_weather.fetch_manager import OpenWeatherFetchManager
+    OpenWeatherMap.FETCHMANAGER = OpenWeatherFetchManager(callsperminute=6000, burst=100)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        owms = [ OpenWeatherMap("KEY", float(lat), 30.0, tmpdir, stuburl) for lat in range(20) ]
+        errors = AsyncOpenWeatherFetcher.Run(owms, concurrency=4, backoff=0.01)
+        nrequests = len(requests)
+        # the fresh cache is used, without API calls
+        again = [ OpenWeatherMap("KEY", float(lat), 30.0, tmpdir, stuburl) for lat in range(2, 20) ]
+        assert AsyncOpenWeatherFetcher.Run(again) == [None] * len(again)
+        assert len(requests) == nrequests and all(len(owm.f) == 41 for owm in again)
+
+        # the same place many times, with fewer executor threads than places
+        # in flight: one fetch, the others wait for it and read its cache
+        async def samekey() -> List[Optional[Exception]]:
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+            fetcher: AsyncOpenWeatherFetcher = AsyncOpenWeatherFetcher(concurrency=8)
+            try:
+                same = [ OpenWeatherMap("KEY", 50.0, 30.0, tmpdir, stuburl) for i in range(12) ]
+                return await asyncio.wait_for(fetcher.FetchMany(same), 10)
+            finally:
+                await fetcher.Close()
+        assert asyncio.run(samekey()) == [None] * 12
+        assert len(requests) == nrequests + 2
+
+    for owm, error in zip(owms, errors):
+        if owm.LAT == 1.0:
+            assert isinstance(error, HTTPError) and error.status == 401, error
+        else:
+            assert error is None, error
+            assert len(owm.f) == 41 and owm.GetCurr().temp == 10.0
+    assert OpenWeatherMap.FETCHMANAGER.calls_made == 2 * len(owms) + 2
+    print("fetched %i places with %i requests over %i connections" % (len(owms), len(requests), len(connections)))
+    httpd.shutdown()
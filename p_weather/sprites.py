@@ -1,8 +1,103 @@
 from PIL import Image
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 import random
+import re
 import os
 
+
+class AtlasSprite:
+    """
+    One decoded sprite: its palette values plus precompiled paste masks
+    for the pixels drawn Black (BLACK and RED) and White.
+    """
+
+    __slots__ = ("w", "h", "data", "black", "white")
+
+    BLACKMAP: bytes = bytes(255 if v in (0, 2) else 0 for v in range(256))
+    WHITEMAP: bytes = bytes(255 if v == 1 else 0 for v in range(256))
+
+    def __init__(self, w: int, h: int, data: bytes):
+        self.w: int = w
+        self.h: int = h
+        self.data: bytes = data
+        self.black: Optional[Image.Image] = AtlasSprite.MakeMask(w, h, data.translate(AtlasSprite.BLACKMAP))
+        self.white: Optional[Image.Image] = AtlasSprite.MakeMask(w, h, data.translate(AtlasSprite.WHITEMAP))
+
+    @staticmethod
+    def MakeMask(w: int, h: int, maskdata: bytes) -> Optional[Image.Image]:
+        if not any(maskdata):
+            return None
+        return Image.frombytes("L", (w, h), maskdata).convert("1")
+
+
+
+class SpriteAtlas:
+    """
+    All "name_NN" sprites of a directory, decoded once and shared
+    between every Sprites instance drawing from that directory.
+
+    Each sprite is kept as its width, height and a row-major byte string
+    of palette values (BLACK, WHITE, RED or TRANS for anything else).
+    """
+
+    BLACK: int = 0
+    WHITE: int = 1
+    RED: int = 2
+    TRANS: int = 3
+
+    EXT: str = ".png"
+
+    _atlases: Dict[str, "SpriteAtlas"] = {}
+
+    @staticmethod
+    def Get(spritesdir: str) -> "SpriteAtlas":
+        key: str = os.path.abspath(spritesdir)
+        atlas: Optional[SpriteAtlas] = SpriteAtlas._atlases.get(key)
+        if atlas is None:
+            atlas = SpriteAtlas(spritesdir)
+            SpriteAtlas._atlases[key] = atlas
+        return atlas
+
+    def __init__(self, spritesdir: str, ext: str = EXT):
+        self.dir: str = spritesdir
+        self.ext: str = ext
+        self.sprites: Dict[Tuple[str, int], AtlasSprite] = {}
+
+        namere = re.compile(r"^(.+)_(\d\d)" + re.escape(ext) + "$")
+        for filename in sorted(os.listdir(spritesdir)):
+            m = namere.match(filename)
+            if m is None:
+                continue
+            with Image.open(os.path.join(spritesdir, filename)) as img:
+                self.sprites[(m.group(1), int(m.group(2)))] = self.Decode(img)
+
+    @classmethod
+    def Decode(cls, img: Image.Image) -> AtlasSprite:
+        w: int
+        h: int
+        w, h = img.size
+        known: Tuple[int, int, int] = (cls.BLACK, cls.WHITE, cls.RED)
+        data: bytes = bytes(v if v in known else cls.TRANS for v in img.getdata())
+        return AtlasSprite(w, h, data)
+
+    def FilePath(self, name: str, index: int) -> str:
+        return os.path.join(self.dir, "%s_%02i%s" % (name, index, self.ext))
+
+    def Has(self, name: str, index: int) -> bool:
+        return (name, index) in self.sprites
+
+    def Sprite(self, name: str, index: int) -> AtlasSprite:
+        sprite: Optional[AtlasSprite] = self.sprites.get((name, index))
+        if sprite is None:
+            raise FileNotFoundError("Sprite not found: '%s'" % self.FilePath(name, index))
+        return sprite
+
+    def Size(self, name: str, index: int) -> Tuple[int, int]:
+        sprite: AtlasSprite = self.Sprite(name, index)
+        return (sprite.w, sprite.h)
+
+
+
 class Sprites:
 
     Black: int = 0
@@ -19,11 +114,15 @@ class Sprites:
     EXT: str = ".png"
 
 
-    def __init__(self, spritesdir: str, canvas: Image.Image):
+    def __init__(self, spritesdir: str, canvas: Image.Image, rng: Optional[random.Random] = None):
         self.img: Image.Image = canvas
+        # Source of the scattered clouds, rain, snow and trees: a seeded
+        # random.Random gives the same picture for the same forecast
+        self.random: Any = rng if rng is not None else random
         self.pix= self.img.load()
         self.dir: str = spritesdir
         self.ext: str = self.EXT
+        self.atlas: SpriteAtlas = SpriteAtlas.Get(spritesdir)
         self.w: int
         self.h: int
         self.w, self.h = self.img.size
@@ -44,28 +143,15 @@ class Sprites:
 
         #print("DRAW '%s' #%i at %i,%i" % (name,index,xpos,ypos))
 
-        imagefilename: str = "%s_%02i%s" % (name, index, self.ext)
-        imagepath: str = os.path.join(self.dir,imagefilename)
-        img: Image.Image = Image.open(imagepath)
-        w: int
-        h: int
-        w, h = img.size
-        pix= img.load()
-        ypos -= h
-        for x in range(w):
-            for y in range(h):
-                if (xpos+x>=self.w) or (xpos+x<0):
-                    continue
-                if (ypos+y>=self.h) or (ypos+y<0):
-                    continue
-                if (pix[x,y]==self.BLACK):
-                    self.Dot(xpos+x,ypos+y,self.Black)
-                elif (pix[x,y]==self.WHITE):
-                    self.Dot(xpos+x,ypos+y,self.White)
-                elif (pix[x,y]==self.RED):
-                    self.Dot(xpos+x,ypos+y,self.Black)
+        sprite: AtlasSprite = self.atlas.Sprite(name, index)
+        ypos -= sprite.h
+        # RED is drawn as Black, TRANS pixels are left untouched
+        if sprite.black is not None:
+            self.img.paste(self.Black, (xpos, ypos), sprite.black)
+        if sprite.white is not None:
+            self.img.paste(self.White, (xpos, ypos), sprite.white)
 
-        return w
+        return sprite.w
 
 
     DIGITPLAS: int = 10
@@ -138,7 +224,7 @@ class Sprites:
         dx: int = width
         dy: int = 16
         for c in cloudset:
-            self.Draw("cloud",c,xpos+random.randrange(dx),ypos)
+            self.Draw("cloud",c,xpos+self.random.randrange(dx),ypos)
 
     HEAVYRAIN: float = 5.0
     RAINFACTOR: int = 20
@@ -153,7 +239,7 @@ class Sprites:
                     continue
                 if (y>=self.h):
                     continue
-                if (random.random()>r):
+                if (self.random.random()>r):
                     self.pix[x,y] = self.Black
                     self.pix[x,y-1] = self.Black
 
@@ -170,7 +256,7 @@ class Sprites:
                     continue
                 if (y>=self.h):
                     continue
-                if (random.random()>r):
+                if (self.random.random()>r):
                     self.pix[x,y] = self.Black
 
 
@@ -208,7 +294,7 @@ class Sprites:
             self.DrawWind_dirsprite(direction,180,"palm",list)
             self.DrawWind_dirsprite(direction,270,"tree",list)
 
-            random.shuffle(list)
+            self.random.shuffle(list)
 
             windindex: Optional[List[int]] = None
             if   (speed<=0.4):
@@ -233,7 +319,7 @@ class Sprites:
 
             if (windindex!=None):
                 ix: int = int(xpos)
-                random.shuffle(windindex)
+                self.random.shuffle(windindex)
                 j: int = 0
                 #print("wind>>>",direction,speed,list,windindex);
                 for i in windindex:
@@ -245,13 +331,10 @@ class Sprites:
                     j+=1
 
     def DrawRainbow(self, xpos: int, ypos: int) -> None:
-        rainbow_file: str = f"rainbow_00{self.ext}"
-        rainbow_path: str = os.path.join(self.dir, rainbow_file)
-
-        if os.path.exists(rainbow_path):
+        if self.atlas.Has("rainbow", 0):
             self.Draw("rainbow", 0, xpos, ypos)
         else:
-            print(f"Warning: Rainbow sprite not found at {rainbow_path}")
+            print(f"Warning: Rainbow sprite not found at {self.atlas.FilePath('rainbow', 0)}")
             # Fallback: Draw a simple rainbow arc if sprite is missing
             colors: List[Tuple[int, int, int]] = [(255,0,0), (255,127,0), (255,255,0), (0,255,0), (0,0,255), (75,0,130), (143,0,255)]
             radius: int = 50
@@ -1,8 +1,10 @@
 from math import cos, sin, acos, asin, tan
 from math import degrees as deg, radians as rad
 from datetime import date, datetime, time, timedelta
+from collections import OrderedDict
 import logging
-from typing import Optional
+import threading
+from typing import List, Optional, Tuple
 
 class sun:
     """
@@ -21,35 +23,87 @@ class sun:
         self.long: float = long
         self.tzoffset: float = (datetime.now() - datetime.utcnow()).total_seconds() / (60 * 60)
 
+    # Solar events only change per calendar day and location, so they are
+    # computed once per (lat, long, tzoffset, date) and kept in a shared LRU
+    CACHE_SIZE: int = 1024
+
+    __cache: "OrderedDict[Tuple[float, float, float, date], Tuple[datetime, datetime, datetime]]" = OrderedDict()
+    __cachelock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def setcachesize(cls, size: int) -> None:
+        with sun.__cachelock:
+            cls.CACHE_SIZE = size
+            while len(sun.__cache) > max(size, 0):
+                sun.__cache.popitem(last=False)
+
+    @staticmethod
+    def clearcache() -> None:
+        with sun.__cachelock:
+            sun.__cache.clear()
+
+    def events(self, day: date) -> Tuple[datetime, datetime, datetime]:
+        """
+        return (sunrise, sunset, solarnoon) as datetime.datetime objects
+        for the calendar day of day (a datetime.date or datetime.datetime)
+        """
+        if isinstance(day, datetime):
+            day = day.date()
+        key = (self.lat, self.long, self.tzoffset, day)
+        with sun.__cachelock:
+            result = sun.__cache.get(key)
+            if result is not None:
+                sun.__cache.move_to_end(key)
+                return result
+
+        # evaluated at local noon, the middle of the day the events belong to
+        when = datetime.combine(day, time(12))
+        self.__preptime(when)
+        self.__calc()
+        result = (sun.__timefromdecimalday(self.sunrise_t, when),
+                  sun.__timefromdecimalday(self.sunset_t, when),
+                  sun.__timefromdecimalday(self.solarnoon_t, when))
+        logging.debug("Solar events for %s at %s,%s: %s", day, self.lat, self.long, result)
+
+        with sun.__cachelock:
+            sun.__cache[key] = result
+            while len(sun.__cache) > max(self.CACHE_SIZE, 0):
+                sun.__cache.popitem(last=False)
+        return result
+
+    def eventrange(self, start: date, end: date) -> List[Tuple[date, datetime, datetime, datetime]]:
+        """
+        return [(day, sunrise, sunset, solarnoon), ...] for every
+        calendar day from start to end inclusive
+        """
+        if isinstance(start, datetime):
+            start = start.date()
+        if isinstance(end, datetime):
+            end = end.date()
+        result = []
+        day = start
+        while day <= end:
+            result.append((day,) + self.events(day))
+            day += timedelta(days=1)
+        return result
+
     def sunrise(self, when: Optional[datetime] = None) -> datetime:
         """
-        return the time of sunrise as a datetime.time object
+        return the time of sunrise as a datetime.datetime object
         when is a datetime.datetime object. If none is given
         a local time zone is assumed (including daylight saving
         if present)
         """
         if when is None: when = datetime.now()
-        self.__preptime(when)
-        self.__calc()
-        result = sun.__timefromdecimalday(self.sunrise_t, when)
-        logging.debug(f"Sunrise calculation - Input: {when}, Result: {result}")
-        return result
+        return self.events(when)[0]
 
     def sunset(self, when: Optional[datetime] = None) -> datetime:
         if when is None: when = datetime.now()
-        self.__preptime(when)
-        self.__calc()
-        result = sun.__timefromdecimalday(self.sunset_t, when)
-        logging.debug(f"Sunset calculation - Input: {when}, Result: {result}")
-        return result
+        return self.events(when)[1]
 
     def solarnoon(self, when: Optional[datetime] = None) -> datetime:
         if when is None: when = datetime.now()
-        self.__preptime(when)
-        self.__calc()
-        result = sun.__timefromdecimalday(self.solarnoon_t, when)
-        logging.debug(f"Solar noon calculation - Input: {when}, Result: {result}")
-        return result
+        return self.events(when)[2]
 
     @staticmethod
     def __timefromdecimalday(d: float, when: datetime) -> datetime:
@@ -61,16 +115,11 @@ class sun:
         seconds = (minutes - m) * 60
         s = int(seconds)
 
-        # Add debugging output
-        logging.debug(f"Original d: {d}, hours: {hours}, h: {h}, m: {m}, s: {s}")
-
         when += timedelta(days=int(days))
 
         # Ensure h is within 0-23 range
         h = h % 24
 
-        logging.debug(f"Adjusted when: {when}, h: {h}, m: {m}, s: {s}")
-
         return datetime(when.year, when.month, when.day, h, m, s)
 
     def __preptime(self, when: datetime) -> None:
@@ -0,0 +1,97 @@
+import numpy as np
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+from p_weather.sunrise import sun
+
+
+# days from the proleptic Gregorian ordinal of 1970-01-01 (numpy's epoch)
+# to the NOAA day number 1=1/1/1900 used by sun
+EPOCH_ORDINAL: int = date(1970, 1, 1).toordinal()
+NOAA_DAY_OFFSET: int = 734124 - 40529
+
+
+def sunevents(days, lat, long, tzoffset: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of sun.events: sunrise, sunset and solar noon for
+    arrays of days, latitudes and longitudes (broadcast together).
+
+    days are anything numpy converts to datetime64[D] (datetime.date
+    objects, ISO strings, datetime64). Results are datetime64[s] local
+    times. Where the sun does not rise or set (polar day or night)
+    sunrise and sunset are NaT; solar noon is always defined.
+    """
+    if tzoffset is None:
+        tzoffset = (datetime.now() - datetime.utcnow()).total_seconds() / (60 * 60)
+
+    d = np.asarray(days, dtype="datetime64[D]")
+    latitude = np.asarray(lat, dtype=float)
+    longitude = np.asarray(long, dtype=float)
+    d, latitude, longitude = np.broadcast_arrays(d, latitude, longitude)
+
+    # same equations as sun.__calc, evaluated at local noon like sun.events
+    day = d.astype(np.int64) + EPOCH_ORDINAL - NOAA_DAY_OFFSET
+    Jday = day + 2415018.5 + 0.5 - tzoffset / 24
+    Jcent = (Jday - 2451545) / 36525
+
+    Manom = 357.52911 + Jcent * (35999.05029 - 0.0001537 * Jcent)
+    Mlong = 280.46646 + Jcent * (36000.76983 + Jcent * 0.0003032) % 360
+    Eccent = 0.016708634 - Jcent * (0.000042037 + 0.0001537 * Jcent)
+    Mobliq = 23 + (26 + ((21.448 - Jcent * (46.815 + Jcent * (0.00059 - Jcent * 0.001813)))) / 60) / 60
+    obliq = Mobliq + 0.00256 * np.cos(np.radians(125.04 - 1934.136 * Jcent))
+    vary = np.tan(np.radians(obliq / 2)) * np.tan(np.radians(obliq / 2))
+    Seqcent = np.sin(np.radians(Manom)) * (1.914602 - Jcent * (0.004817 + 0.000014 * Jcent)) + np.sin(
+        np.radians(2 * Manom)) * (0.019993 - 0.000101 * Jcent) + np.sin(np.radians(3 * Manom)) * 0.000289
+    Struelong = Mlong + Seqcent
+    Sapplong = Struelong - 0.00569 - 0.00478 * np.sin(np.radians(125.04 - 1934.136 * Jcent))
+    declination = np.degrees(np.arcsin(np.sin(np.radians(obliq)) * np.sin(np.radians(Sapplong))))
+
+    eqtime = 4 * np.degrees(vary * np.sin(2 * np.radians(Mlong)) - 2 * Eccent * np.sin(np.radians(Manom))
+                            + 4 * Eccent * vary * np.sin(np.radians(Manom)) * np.cos(2 * np.radians(Mlong))
+                            - 0.5 * vary * vary * np.sin(4 * np.radians(Mlong))
+                            - 1.25 * Eccent * Eccent * np.sin(2 * np.radians(Manom)))
+
+    cosha = np.cos(np.radians(90.833)) / (np.cos(np.radians(latitude)) * np.cos(np.radians(declination))) \
+        - np.tan(np.radians(latitude)) * np.tan(np.radians(declination))
+    polar = np.abs(cosha) > 1
+    hourangle = np.degrees(np.arccos(np.clip(cosha, -1, 1)))
+
+    solarnoon_t = (720 - 4 * longitude - eqtime + tzoffset * 60) / 1440
+    sunrise_t = solarnoon_t - hourangle * 4 / 1440
+    sunset_t = solarnoon_t + hourangle * 4 / 1440
+
+    sunrise = _timefromdecimalday(sunrise_t, d)
+    sunset = _timefromdecimalday(sunset_t, d)
+    sunrise[polar] = np.datetime64("NaT")
+    sunset[polar] = np.datetime64("NaT")
+    return sunrise, sunset, _timefromdecimalday(solarnoon_t, d)
+
+
+def _timefromdecimalday(t: np.ndarray, d: np.ndarray) -> np.ndarray:
+    seconds = np.floor(t * 86400).astype(np.int64)
+    return d.astype("datetime64[s]") + seconds.astype("timedelta64[s]")
+
+
+if __name__ == "__main__":
+
+    # check against the scalar implementation
+    from datetime import timedelta
+
+    tz = 2.0
+    places = [(50.45466, 30.5238), (52.196136, 21.007963), (-33.87, 151.21), (0.0, -78.5), (64.13, -21.9), (-54.8, -68.3)]
+    start = date(2024, 1, 1)
+    alldays = [start + timedelta(days=i) for i in range(366)]
+
+    for lat, lon in places:
+        s = sun(lat, lon)
+        s.tzoffset = tz
+        sr, ss, sn = sunevents(alldays, lat, lon, tz)
+        for i, day in enumerate(alldays):
+            for a, b in zip(s.events(day), (sr[i], ss[i], sn[i])):
+                diff = abs((a - b.astype(datetime)).total_seconds())
+                assert diff <= 1, (lat, lon, day, a, b)
+
+    sr, ss, sn = sunevents(["2024-06-21", "2024-12-21"], [78.22, 78.22], [15.65, 15.65], tz)
+    assert np.isnat(sr).all() and np.isnat(ss).all() and not np.isnat(sn).any()
+
+    print("sunevents matches sun.events for %i days at %i places" % (len(alldays), len(places)))
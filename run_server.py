@@ -1,12 +1,23 @@
 
-import os
+import io
+import json
 import time
 import datetime
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs
 from PIL import Image
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 
 from weather_landscape import WeatherLandscape
+from p_weather.openweathermap import OpenWeatherMap
+from p_weather.fetch_manager import OpenWeatherFetchManager
+from p_weather.fileutil import AtomicWrite
+from p_weather.eink_frame import PackFrame, FrameDelta, PackBits
 
 
 SERV_IPADDR = "0.0.0.0"
@@ -14,83 +25,335 @@ SERV_PORT = 3355
 
 EINKFILENAME = "test.bmp"
 USERFILENAME = "test1.bmp"
+# Raw 1-bit frame in the panel memory layout, streamed by the device as is
+EINKRAWFILENAME = "test.raw"
+# Image responses carry X-Next-Update-Sec: seconds until the image is
+# expected to show new data (next OpenWeather refresh or forecast slot,
+# once rendered), plus a margin. Devices sleep that long.
+NEXTUPDATE_MARGIN_SEC = 30
+
+# Changed lines of test.raw since the frame the device has, requested as
+# test.delta?base=<ETag of that frame>; the last FRAME_HISTORY frames are kept
+EINKDELTAFILENAME = "test.delta"
+# test.raw in PackBits run-length coding, mostly white frames shrink to about half
+EINKRLEFILENAME = "test.rle"
+FRAME_HISTORY = 16
 
 FILETOOOLD_SEC = 60*10
 
+# Serve every request in its own thread, so a slow render or OpenWeather
+# fetch does not block the other clients
+SERV_THREADED = True
+
+# Render in the background ahead of expiry, so requests are always served
+# from the last good render. The cadence follows the OpenWeather cache
+# lifetime, so every pre-render finds expired forecast data and refreshes it.
+SERV_PRERENDER = True
+PRERENDER_PERIOD_SEC = OpenWeatherMap.FILETOOOLD_SEC
+PRERENDER_JITTER_SEC = 30
+PRERENDER_RETRY_SEC = 60
+# Failed refreshes keep the previous image served up to this age
+MAX_STALE_SEC = 60*60*2
+PRERENDER_TICK_SEC = 5
+
+# Other places are requested as /<placekey>/test.bmp or /test.bmp?lat=..&lon=..
+# The state of the most recently used ones is kept, the oldest is dropped
+MAX_LOCATIONS = 64
+
+# OpenWeather calls of all locations share one quota; concurrent fetches
+# of one place are coalesced. Counters are served at /stats
+OWM_CALLS_PER_MINUTE = 60
+OpenWeatherMap.FETCHMANAGER = OpenWeatherFetchManager(OWM_CALLS_PER_MINUTE)
+
+# Devices within the same grid cell of this size share one cached
+# forecast; 0 keys the cache on the exact place
+OWM_CACHE_GRID_KM = 0.0
+OpenWeatherMap.CACHE_GRID_KM = OWM_CACHE_GRID_KM
+
+# Keep a binary snapshot of each parsed forecast for fast reloads
+OWM_BINARY_CACHE = True
+OpenWeatherMap.BINARY_CACHE = OWM_BINARY_CACHE
+
 WEATHER = WeatherLandscape()
 
 
+class RenderedImage:
+
+    def __init__(self, data, mtime, contenttype="image/bmp"):
+        self.data = data
+        self.mtime = mtime
+        self.contenttype = contenttype
+        self.etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        self.lastmodified = formatdate(mtime, usegmt=True)
+
+    def IsMatch(self, ifnonematch):
+        if ifnonematch is None:
+            return False
+        tags = [ tag.strip() for tag in ifnonematch.split(',') ]
+        return ('*' in tags) or (self.etag in tags) or (('W/'+self.etag) in tags)
+
+
+class LocationState:
+
+    def __init__(self, weather):
+        self.weather = weather
+        self.placekey = weather.PLACEKEY
+        self.isdefault = (self.placekey == WEATHER.PLACEKEY)
+        # Last rendered images by file name, served from memory
+        self.images = {}
+        # Single-flight rendering: concurrent requests for a stale image wait
+        # for the one render in progress instead of starting their own
+        self.lock = threading.Lock()
+        self.nextrender = 0.0
+        self.nextupdate = None
+        # Recent raw frames by ETag (without quotes), bases for deltas
+        self.frames = OrderedDict()
+
+    def TmpFilePath(self, file_name):
+        if self.isdefault:
+            return self.weather.TmpFilePath(file_name)
+        return self.weather.TmpFilePath(self.placekey+"_"+file_name)
+
+    def IsImageTooOld(self, file_name, maxage):
+        image = self.images.get(file_name)
+        return (image is None) or ( (time.time() - image.mtime) > maxage )
+
+    def CreateWeatherImages(self, maxage):
+
+        if not self.IsImageTooOld(USERFILENAME, maxage):
+            return
+
+        with self.lock:
+            # the images may have been rendered while waiting for the lock
+            if not self.IsImageTooOld(USERFILENAME, maxage):
+                return
+            self.RenderWeatherImages()
+
+    def RenderWeatherImages(self, period=PRERENDER_PERIOD_SEC, jitter=PRERENDER_JITTER_SEC):
+
+        img = self.weather.MakeImage() 
+        nextupdate = getattr(self.weather, "nextupdate", None)
+
+        eink_img = img.rotate(-90, expand=True)   
+        eink_img = eink_img.transpose(Image.FLIP_TOP_BOTTOM)  
+
+        mtime = time.time()
+        images = {}
+        for file_name, image in ((EINKFILENAME, eink_img), (USERFILENAME, img)):
+            buf = io.BytesIO()
+            image.save(buf, format="BMP")
+            images[file_name] = RenderedImage(buf.getvalue(), mtime)
+        images[EINKRAWFILENAME] = RenderedImage(PackFrame(img), mtime, "application/octet-stream")
+        images[EINKRLEFILENAME] = RenderedImage(PackBits(images[EINKRAWFILENAME].data), mtime, "application/x-packbits")
+        for file_name, image in images.items():
+            AtomicWrite(self.TmpFilePath(file_name), image.data)
+
+        # whoever rendered, on request or ahead, the scheduler waits a full period
+        self.nextrender = mtime + period + random.uniform(0, jitter)
+        # the user image age decides staleness, so it is published last
+        self.images[EINKFILENAME] = images[EINKFILENAME]
+        self.images[EINKRAWFILENAME] = images[EINKRAWFILENAME]
+        self.images[EINKRLEFILENAME] = images[EINKRLEFILENAME]
+        self.images[USERFILENAME] = images[USERFILENAME] 
+        self.nextupdate = nextupdate
+
+        frame = images[EINKRAWFILENAME]
+        self.frames[frame.etag.strip('"')] = frame.data
+        self.frames.move_to_end(frame.etag.strip('"'))
+        while len(self.frames) > FRAME_HISTORY:
+            self.frames.popitem(last=False)
+
+    def NextUpdateSec(self):
+        image = self.images.get(USERFILENAME)
+        if image is None:
+            return NEXTUPDATE_MARGIN_SEC
+        # a new image is rendered by the scheduler, or on request once the last one is too old
+        ready = self.nextrender if SERV_PRERENDER else image.mtime + FILETOOOLD_SEC
+        nextupdate = max(ready, self.nextupdate or 0.0)
+        return max(0, int(nextupdate - time.time())) + NEXTUPDATE_MARGIN_SEC
+
+    def FrameDelta(self, base, image):
+        """
+        Delta from the frame with ETag base to the raw image, and
+        whether base was known (otherwise the delta is a full frame)
+        """
+        frame = image.data
+        basedata = self.frames.get(base.strip('"')) if base else None
+        return FrameDelta(basedata, frame), (basedata is not None)
+
+
+LOCATIONS = OrderedDict()
+LOCATIONS_LOCK = threading.Lock()
+
+
+def GetLocation(latitude=None, longitude=None):
+    placekey = WEATHER.PLACEKEY if latitude is None else OpenWeatherMap.MakePlaceKey(latitude, longitude)
+    with LOCATIONS_LOCK:
+        location = LOCATIONS.get(placekey)
+        if location is None:
+            weather = WEATHER if latitude is None else WeatherLandscape(latitude, longitude)
+            location = LocationState(weather)
+            LOCATIONS[placekey] = location
+            while len(LOCATIONS) > MAX_LOCATIONS:
+                LOCATIONS.popitem(last=False)
+        LOCATIONS.move_to_end(placekey)
+        return location
+
+
+class PreRenderScheduler(threading.Thread):
+
+    def __init__(self, period=PRERENDER_PERIOD_SEC, jitter=PRERENDER_JITTER_SEC, retry=PRERENDER_RETRY_SEC, tick=PRERENDER_TICK_SEC):
+        super().__init__(name="prerender", daemon=True)
+        self.period = period
+        self.jitter = jitter
+        self.retry = retry
+        self.tick = tick
+
+    def run(self):
+        while True:
+            with LOCATIONS_LOCK:
+                locations = list(LOCATIONS.values())
+            for location in locations:
+                if time.time() < location.nextrender:
+                    continue
+                try:
+                    with location.lock:
+                        location.RenderWeatherImages(self.period, self.jitter)
+                except Exception as e:
+                    print("Pre-render failed:",location.placekey,e)
+                    location.nextrender = time.time() + self.retry
+            time.sleep(self.tick)
+
+
 class WeatherLandscapeServer(BaseHTTPRequestHandler):
 
 
     
 
     def do_GET(self):
-        
-        if self.path == '/':
-           self.path = '/index.html'
-           
-           
+
         print("GET:",self.path)
+
+        try:
+            location, path = self.ParseLocation()
+        except ValueError as e:
+            print("Location error:",e)
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        if path == '/':
+           path = '/index.html'
            
-        if (self.path.startswith('/index.html')):
+        if (path == '/index.html'):
            self.send_response(200)
            self.end_headers()
-           self.wfile.write(bytes(self.IndexHtml(), 'utf-8'))
+           self.wfile.write(bytes(self.IndexHtml(location), 'utf-8'))
            
            
-        if (self.path.startswith('/'+EINKFILENAME)) or (self.path.startswith('/'+USERFILENAME)):
-        
-            self.CreateWeatherImages() 
-        
-            databytes = bytearray()
+        elif (path == '/stats'):
+           self.send_response(200)
+           self.send_header("Content-type", "application/json")
+           self.end_headers()
+           self.wfile.write(bytes(json.dumps(OpenWeatherMap.FETCHMANAGER.Stats()), 'utf-8'))
+
+
+        elif path in ('/'+EINKFILENAME, '/'+EINKRAWFILENAME, '/'+EINKRLEFILENAME, '/'+USERFILENAME):
+
+            file_name = path[1:]
+
             try:
-            
-               file_name = WEATHER.TmpFilePath(self.path[1:])
-               f = open(file_name, "rb") 
-               databytes = f.read()               
-               f.close()
-               self.send_response(200)
-               s.send_header("Content-type", "image/bmp")
-            except:
-               file_to_open = "File not found"
-               self.send_response(404)
+                location.CreateWeatherImages(MAX_STALE_SEC if SERV_PRERENDER else FILETOOOLD_SEC)
+                image = location.images[file_name]
+            except Exception as e:
+                print("Image error:",e)
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            if image.IsMatch(self.headers.get('If-None-Match')):
+                self.send_response(304)
+                self.SendCacheHeaders(image, location)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-type", image.contenttype)
+            self.send_header("Content-Length", str(len(image.data)))
+            self.SendCacheHeaders(image, location)
             self.end_headers()
-            self.wfile.write(databytes)
+            self.wfile.write(image.data)
 
+        elif (path == '/'+EINKDELTAFILENAME):
 
-    def IsFileTooOld(self, filename):
-        return (not os.path.isfile(filename)) or ( (time.time() - os.stat(filename).st_mtime) > FILETOOOLD_SEC )
+            base = parse_qs(urlsplit(self.path).query).get('base', [None])[0]
 
+            try:
+                location.CreateWeatherImages(MAX_STALE_SEC if SERV_PRERENDER else FILETOOOLD_SEC)
+                image = location.images[EINKRAWFILENAME]
+            except Exception as e:
+                print("Image error:",e)
+                self.send_response(404)
+                self.end_headers()
+                return
 
-    def CreateWeatherImages(self):
-                    
-        user_file_name = WEATHER.TmpFilePath(USERFILENAME)
-        eink_file_name = WEATHER.TmpFilePath(EINKFILENAME)
-       
-        if not self.IsFileTooOld(user_file_name):
-            return
-       
-        img = WEATHER.MakeImage() 
-        img.save(user_file_name) 
-        
-        img = img.rotate(-90, expand=True)   
-        img = img.transpose(Image.FLIP_TOP_BOTTOM)  
-        
-        img.save(eink_file_name) 
-        
-        
-        
-        
+            if (base is not None) and (base.strip('"') == image.etag.strip('"')):
+                self.send_response(304)
+                self.SendCacheHeaders(image, location)
+                self.end_headers()
+                return
+
+            # the image the headers describe, not a newer one rendered meanwhile
+            delta, isbaseknown = location.FrameDelta(base, image)
+
+            self.send_response(200)
+            self.send_header("Content-type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(delta)))
+            if isbaseknown:
+                self.send_header("X-Frame-Base", base.strip('"'))
+            self.SendCacheHeaders(image, location)
+            self.end_headers()
+            self.wfile.write(delta)
+
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+
+    def ParseLocation(self):
+        # /<placekey>/<file> or /<file>?lat=<lat>&lon=<lon> or /<file>
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        parts = path.split('/')
+        if (len(parts)>=3) and (len(parts[1])==12):
+            latitude, longitude = OpenWeatherMap.ParsePlaceKey(parts[1])
+            return GetLocation(latitude, longitude), '/'+'/'.join(parts[2:])
+        if ('lat' in query) and ('lon' in query):
+            latitude = float(query['lat'][0])
+            longitude = float(query['lon'][0])
+            if not (-90<=latitude<=90) or not (-180<=longitude<=180):
+                raise ValueError("Coordinates out of range: %f,%f" % (latitude,longitude))
+            return GetLocation(latitude, longitude), path
+        return GetLocation(), path
 
 
-    def IndexHtml(self):
+    def SendCacheHeaders(self, image, location):
+        self.send_header("ETag", image.etag)
+        self.send_header("Last-Modified", image.lastmodified)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Next-Update-Sec", str(location.NextUpdateSec()))
+
+
+    def IndexHtml(self, location):
     
+        weather = location.weather
+        prefix = '' if location.isdefault else '/'+location.placekey+'/'
         body = '<h1>Weather as Landscape</h1>'
-        body+='<p>Place: '+("%.4f" % WEATHER.OWM_LAT) +' , '+("%.4f" % WEATHER.OWM_LON)+'</p>'
-        body+='<p><img src="'+USERFILENAME+'" alt="Weather" "></p>'
+        body+='<p>Place: '+("%.4f" % weather.OWM_LAT) +' , '+("%.4f" % weather.OWM_LON)+'</p>'
+        body+='<p><img src="'+prefix+USERFILENAME+'" alt="Weather" "></p>'
         body+='<p>ESP32 URL: <span id="eink"></span></p>'
-        body+='<script> document.getElementById("eink").innerHTML = window.location+"'+EINKFILENAME+'" ;</script>'
+        body+='<script> document.getElementById("eink").innerHTML = window.location.origin+"'+(prefix or '/')+EINKFILENAME+'" ;</script>'
             
             
         return """
@@ -111,7 +374,15 @@ class WeatherLandscapeServer(BaseHTTPRequestHandler):
 
 
 
-httpd = HTTPServer((SERV_IPADDR,SERV_PORT),WeatherLandscapeServer)
+GetLocation()
+
+if SERV_PRERENDER:
+    PreRenderScheduler().start()
+
+if SERV_THREADED:
+    httpd = ThreadingHTTPServer((SERV_IPADDR,SERV_PORT),WeatherLandscapeServer)
+else:
+    httpd = HTTPServer((SERV_IPADDR,SERV_PORT),WeatherLandscapeServer)
 print(r"Serving at http://%s:%i/" % (SERV_IPADDR,SERV_PORT))
 httpd.serve_forever() 
 
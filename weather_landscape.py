@@ -1,15 +1,57 @@
 import os
+import time
+import random
+import hashlib
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image as PILImage
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
 
-from p_weather.openweathermap import OpenWeatherMap
-from p_weather.sprites import Sprites
+from p_weather.openweathermap import OpenWeatherMap, ForecastColumns
+from p_weather.sprites import Sprites, SpriteAtlas
 from p_weather.draw_weather import DrawWeather
+from p_weather.fileutil import AtomicPath
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+
+class BatchResult:
+
+    def __init__(self, latitude: float, longitude: float) -> None:
+        self.latitude: float = latitude
+        self.longitude: float = longitude
+        self.placekey: str = OpenWeatherMap.MakePlaceKey(latitude, longitude)
+        self.filename: Optional[str] = None
+        self.error: Optional[str] = None
+        self.seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        status: str = self.filename if self.ok else f"FAILED {self.error}"
+        return f"{self.placekey} ({self.latitude:.4f},{self.longitude:.4f}) {self.seconds:.3f}s {status}"
+
+
+def _BatchWorkerInit() -> None:
+    # warm every worker process once: sprites and template in memory
+    SpriteAtlas.Get(WeatherLandscape.SPRITES_DIR)
+    WeatherLandscape.Template()
+
+
+def _BatchWorkerSave(latitude: float, longitude: float) -> BatchResult:
+    result: BatchResult = BatchResult(latitude, longitude)
+    t0: float = time.perf_counter()
+    try:
+        result.filename = WeatherLandscape(latitude, longitude).SaveImage()
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.seconds = time.perf_counter() - t0
+    return result
+
+
 class WeatherLandscape:
     OWM_KEY: str = "7d4c9a66d83ea191504f10e3e96afb23"  # Replace with your actual API key
     OWM_LAT: float = 52.196136
@@ -22,28 +64,41 @@ class WeatherLandscape:
     SPRITES_DIR: str = "p_weather/sprite"
     DRAWOFFSET: int = 65
 
-    def __init__(self) -> None:
+    _templates: Dict[str, PILImage.Image] = {}
+
+    def __init__(self, latitude: Optional[float] = None, longitude: Optional[float] = None) -> None:
         assert self.OWM_KEY!=None, "Set OWM_KEY variable to your OpenWeather API key"
-        pass
+        if latitude is not None:
+            self.OWM_LAT = latitude
+        if longitude is not None:
+            self.OWM_LON = longitude
+        SpriteAtlas.Get(self.SPRITES_DIR)
+        # When the data of the last image changes, see OpenWeatherMap.NextUpdateTime
+        self.nextupdate: Optional[float] = None
+        # Forecast of the last image as columns, reused while the cache
+        # files it was read from are unchanged (see OpenWeatherMap.CacheStamp)
+        self.forecast: Optional[ForecastColumns] = None
+        self.forecaststamp: Optional[Tuple[int, int]] = None
 
     def MakeImage(self) -> PILImage.Image:
         try:
             logger.debug("Starting MakeImage method")
             owm: OpenWeatherMap = OpenWeatherMap(self.OWM_KEY, self.OWM_LAT, self.OWM_LON, self.TMP_DIR)
-            owm.FromAuto()
+            forecast: ForecastColumns = self.LoadForecast(owm)
+            self.nextupdate = owm.NextUpdateTime(forecast)
             logger.debug("OpenWeatherMap data fetched")
 
-            img: PILImage.Image = PILImage.open(self.TEMPLATE_FILENAME)
+            img: PILImage.Image = self.Template()
             logger.debug(f"Template image opened: {self.TEMPLATE_FILENAME}")
             logger.debug(f"Image type: {type(img)}, size: {img.size}, mode: {img.mode}")
 
-            spr: Sprites = Sprites(self.SPRITES_DIR, img)
+            spr: Sprites = Sprites(self.SPRITES_DIR, img, self.RenderRandom(forecast))
             logger.debug("Sprites initialized")
 
             art: DrawWeather = DrawWeather(img, spr)
             logger.debug("DrawWeather initialized")
 
-            art.Draw(self.DRAWOFFSET, owm)
+            art.Draw(self.DRAWOFFSET, forecast)
             logger.debug("Drawing completed")
 
             logger.debug(f"Final image type: {type(img)}, size: {img.size}, mode: {img.mode}")
@@ -52,17 +107,34 @@ class WeatherLandscape:
             logger.error(f"Error in MakeImage: {str(e)}", exc_info=True)
             raise
 
+    def LoadForecast(self, owm: OpenWeatherMap) -> ForecastColumns:
+        if (self.forecast is not None) and (not owm.IsCacheTooOld()) and (owm.CacheStamp()==self.forecaststamp):
+            return self.forecast
+        owm.FromAuto()
+        self.forecast = owm.ToColumns()
+        self.forecaststamp = owm.CacheStamp()
+        return self.forecast
+
+    def RenderRandom(self, forecast: ForecastColumns) -> random.Random:
+        # Same place and forecast slots give the same scatter of clouds, rain
+        # and trees, so a refetch of unchanged weather gives the same frame.
+        # The current weather (dt[0]) is the observation time and changes on
+        # every fetch, it is left out.
+        h = hashlib.sha1(self.PLACEKEY.encode())
+        h.update(forecast.dt[1:].tobytes())
+        return random.Random(int.from_bytes(h.digest()[:8], "little"))
+
     def SaveImage(self) -> str:
         try:
             logger.debug("Starting SaveImage method")
             img: PILImage.Image = self.MakeImage()
-            placekey: str = OpenWeatherMap.MakePlaceKey(self.OWM_LAT, self.OWM_LON)
-            filename: str = f"{self.OUT_FILENAME}{placekey}{self.OUT_FILEEXT}"
+            filename: str = f"{self.OUT_FILENAME}{self.PLACEKEY}{self.OUT_FILEEXT}"
             outfilepath: str = self.TmpFilePath(filename)
 
             logger.debug(f"Saving image to: {outfilepath}")
             if isinstance(img, PILImage.Image):
-                img.save(outfilepath)
+                with AtomicPath(outfilepath) as tmppath:
+                    img.save(tmppath)
                 logger.debug("Image saved successfully")
             else:
                 raise TypeError("img is not a PIL.Image object")
@@ -72,5 +144,38 @@ class WeatherLandscape:
             logger.error(f"Error in SaveImage: {str(e)}", exc_info=True)
             raise
 
+    @classmethod
+    def Template(cls) -> PILImage.Image:
+        template: Optional[PILImage.Image] = cls._templates.get(cls.TEMPLATE_FILENAME)
+        if template is None:
+            with PILImage.open(cls.TEMPLATE_FILENAME) as f:
+                template = f.copy()
+            cls._templates[cls.TEMPLATE_FILENAME] = template
+        return template.copy()
+
+    @staticmethod
+    def SaveImages(locations: List[Tuple[float, float]], max_workers: Optional[int] = None) -> List[BatchResult]:
+        """
+        Render and save the images of many locations in parallel worker
+        processes. A failing location is reported in its BatchResult and
+        does not stop the others. Results are in the order of locations.
+        """
+        results: List[BatchResult] = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_BatchWorkerInit) as executor:
+            futures = [ executor.submit(_BatchWorkerSave, lat, lon) for lat, lon in locations ]
+            for (lat, lon), future in zip(locations, futures):
+                try:
+                    result: BatchResult = future.result()
+                except Exception as e:
+                    result = BatchResult(lat, lon)
+                    result.error = f"{type(e).__name__}: {e}"
+                logger.info(f"Batch: {result}")
+                results.append(result)
+        return results
+
+    @property
+    def PLACEKEY(self) -> str:
+        return OpenWeatherMap.MakePlaceKey(self.OWM_LAT, self.OWM_LON)
+
     def TmpFilePath(self, filename: str) -> str:
         return os.path.join(self.TMP_DIR, filename)